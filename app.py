@@ -1,16 +1,12 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+from streamlit.errors import StreamlitAPIException
 from datetime import datetime
 import time
 import os
+import html
+from concurrent.futures import ThreadPoolExecutor
 
-from emotion_detector import EmotionDetector
-from therapeutic_ai import TherapeuticAI
-from voice_handler import VoiceHandler
 from session_manager import SessionManager
-from image_analyzer import ImageAnalyzer
 
 # Page configuration
 st.set_page_config(
@@ -20,27 +16,53 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Shared service instances (one per server process, reused across sessions and reruns);
+# modules are imported on first use to keep cold start short
+@st.cache_resource
+def get_emotion_detector():
+    """Get the shared emotion detector"""
+    from emotion_detector import EmotionDetector
+    return EmotionDetector()
+
+@st.cache_resource
+def get_therapeutic_ai():
+    """Get the shared therapeutic AI"""
+    from therapeutic_ai import TherapeuticAI
+    return TherapeuticAI()
+
+@st.cache_resource
+def get_voice_handler():
+    """Get the shared voice handler"""
+    from voice_handler import VoiceHandler
+    return VoiceHandler()
+
+@st.cache_resource
+def get_image_analyzer(gemini_key):
+    """Get the shared image analyzer for the given API key"""
+    from image_analyzer import ImageAnalyzer
+    return ImageAnalyzer(gemini_key)
+
+@st.cache_resource
+def get_reply_executor():
+    """Get the shared pool that runs replies alongside image analysis"""
+    return ThreadPoolExecutor(max_workers=4)
+
 # Initialize session state
+# SessionManager seeds per-session state on construction, so it stays per session
 if 'session_manager' not in st.session_state:
     st.session_state.session_manager = SessionManager()
-if 'emotion_detector' not in st.session_state:
-    st.session_state.emotion_detector = EmotionDetector()
-if 'therapeutic_ai' not in st.session_state:
-    st.session_state.therapeutic_ai = TherapeuticAI()
-if 'voice_handler' not in st.session_state:
-    st.session_state.voice_handler = VoiceHandler()
+st.session_state.emotion_detector = get_emotion_detector()
+st.session_state.therapeutic_ai = get_therapeutic_ai()
+st.session_state.voice_handler = get_voice_handler()
 if 'voice_mode' not in st.session_state:
     st.session_state.voice_mode = False
 if 'processing' not in st.session_state:
     st.session_state.processing = False
-if 'image_analyzer' not in st.session_state:
-    gemini_key = os.getenv("GEMINI_API_KEY", "")
-    if gemini_key:
-        st.session_state.image_analyzer = ImageAnalyzer(gemini_key)
-    else:
-        st.session_state.image_analyzer = None
 
 def main():
+    # Emotion styles, sent once instead of inline with every message
+    st.markdown(_EMOTION_CSS, unsafe_allow_html=True)
+    
     # Header
     st.title("🤖 AI Therapy Chatbot")
     st.markdown("---")
@@ -81,9 +103,7 @@ def main():
         
         if emotions_data:
             # Create emotion chart
-            df = pd.DataFrame(list(emotions_data.items()), columns=['Emotion', 'Count'])
-            fig = px.pie(df, values='Count', names='Emotion', title="Session Emotions")
-            fig.update_layout(height=300)
+            fig = build_emotion_pie(tuple(sorted(emotions_data.items())))
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("Start chatting to see emotion tracking!")
@@ -102,6 +122,11 @@ def main():
         st.metric("Session Duration", f"{stats['duration_minutes']:.1f} min")
     
     # Main chat interface
+    chat_panel()
+
+@st.fragment
+def chat_panel():
+    """Chat and mood panels; reruns on its own so the sidebar is not rebuilt per message"""
     col1, col2 = st.columns([3, 1])
     
     with col1:
@@ -111,26 +136,21 @@ def main():
         
         with chat_container:
             # Display conversation history
-            messages = st.session_state.session_manager.get_messages()
+            messages = list(st.session_state.session_manager.get_messages())
+            
+            # Earlier turns are composed into markdown blocks; only the latest turn
+            # gets full chat widgets
+            latest_turn = max(0, len(messages) - 1)
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i]['role'] == 'user':
+                    latest_turn = i
+                    break
             
-            for msg in messages:
-                if msg['role'] == 'user':
-                    with st.chat_message("user"):
-                        st.write(msg['content'])
-                        if 'emotion' in msg:
-                            emotion_color = get_emotion_color(msg['emotion'])
-                            st.markdown(f"<span style='color: {emotion_color}; font-size: 0.8em;'>Detected emotion: {msg['emotion']}</span>", unsafe_allow_html=True)
-                        st.caption(msg['timestamp'])
-                else:
-                    with st.chat_message("assistant"):
-                        st.write(msg['content'])
-                        st.caption(msg['timestamp'])
-                        
-                        # Audio playback button for AI responses
-                        if 'audio_file' in msg and os.path.exists(msg['audio_file']):
-                            with open(msg['audio_file'], 'rb') as audio_file:
-                                audio_bytes = audio_file.read()
-                                st.audio(audio_bytes, format='audio/wav')
+            if latest_turn > 0:
+                render_history(messages[:latest_turn])
+            
+            for msg in messages[latest_turn:]:
+                render_chat_message(msg)
         
         # Input section
         st.markdown("---")
@@ -177,7 +197,7 @@ def main():
             with col_stop:
                 if st.button("⏹️ Stop & Process", disabled=not st.session_state.processing):
                     st.session_state.processing = False
-                    st.rerun()
+                    rerun_chat_panel()
     
     with col2:
         # Real-time emotion indicator
@@ -186,12 +206,12 @@ def main():
         
         if current_emotion:
             emotion_emoji = get_emotion_emoji(current_emotion)
-            emotion_color = get_emotion_color(current_emotion)
+            emotion_class = current_emotion.lower()
             
             st.markdown(f"""
-            <div style='text-align: center; padding: 20px; border-radius: 10px; background-color: {emotion_color}20;'>
-                <div style='font-size: 3em;'>{emotion_emoji}</div>
-                <div style='font-size: 1.2em; color: {emotion_color}; font-weight: bold;'>{current_emotion.title()}</div>
+            <div class='mood-card mood-{emotion_class}'>
+                <div class='mood-emoji'>{emotion_emoji}</div>
+                <div class='mood-label emo-{emotion_class}'>{current_emotion.title()}</div>
             </div>
             """, unsafe_allow_html=True)
         else:
@@ -206,6 +226,87 @@ def main():
         st.write("• Receive visual therapy suggestions")
         st.write("• Express feelings through imagery")
 
+@st.cache_data(max_entries=256)
+def build_emotion_pie(emotion_counts):
+    """Build the session emotion pie chart; cached on the (emotion, count) tuple"""
+    import pandas as pd
+    import plotly.express as px
+    
+    df = pd.DataFrame(emotion_counts, columns=['Emotion', 'Count'])
+    fig = px.pie(df, values='Count', names='Emotion', title="Session Emotions")
+    fig.update_layout(height=300)
+    return fig
+
+def rerun_chat_panel():
+    """Rerun only the chat panel, or the whole app when not inside a fragment rerun"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def message_audio(msg):
+    """Path of a reply's audio file, or None if it has none or the file is gone"""
+    audio_file = msg.get('audio_file')
+    if msg['role'] != 'user' and audio_file and os.path.exists(audio_file):
+        return audio_file
+    return None
+
+def render_audio(path):
+    """Audio player served by media URL, so the bytes are not resent inside page markup"""
+    st.audio(path, format='audio/mpeg' if path.endswith('.mp3') else 'audio/wav')
+
+def render_chat_message(msg):
+    """Render a single message with chat widgets"""
+    if msg['role'] == 'user':
+        with st.chat_message("user"):
+            st.write(msg['content'])
+            if msg.get('emotion'):
+                st.markdown(emotion_annotation(msg['emotion']), unsafe_allow_html=True)
+            st.caption(message_time(msg))
+    else:
+        with st.chat_message("assistant"):
+            st.write(msg['content'])
+            st.caption(message_time(msg))
+            
+            # Audio playback button for AI responses
+            audio_file = message_audio(msg)
+            if audio_file:
+                render_audio(audio_file)
+
+def message_time(msg):
+    """Display time of a message, formatted on demand"""
+    return msg['datetime'].strftime("%H:%M:%S")
+
+def build_history_markdown(messages):
+    """Compose earlier messages into a single markdown/HTML block"""
+    blocks = []
+    for msg in messages:
+        content = html.escape(msg['content'], quote=False)
+        if msg['role'] == 'user':
+            block = f"**🧑 You** <small>{message_time(msg)}</small>\n\n{content}"
+            if msg.get('emotion'):
+                block += f"\n\n{emotion_annotation(msg['emotion'])}"
+        else:
+            block = f"**🤖 Assistant** <small>{message_time(msg)}</small>\n\n{content}"
+        blocks.append(block)
+    
+    return "\n\n---\n\n".join(blocks)
+
+def render_history(messages):
+    """Render earlier messages as markdown blocks, split only after replies that have audio"""
+    start = 0
+    for i, msg in enumerate(messages):
+        audio_file = message_audio(msg)
+        if audio_file:
+            separator = "---\n\n" if start else ""
+            st.markdown(separator + build_history_markdown(messages[start:i + 1]), unsafe_allow_html=True)
+            render_audio(audio_file)
+            start = i + 1
+    
+    if start < len(messages):
+        separator = "---\n\n" if start else ""
+        st.markdown(separator + build_history_markdown(messages[start:]), unsafe_allow_html=True)
+
 def process_user_input(user_input):
     """Process user text input"""
     st.session_state.processing = True
@@ -219,14 +320,21 @@ def process_user_input(user_input):
         
         # Generate AI response
         conversation_history = st.session_state.session_manager.get_conversation_context()
-        ai_response = st.session_state.therapeutic_ai.generate_response(
+        response_stream = st.session_state.therapeutic_ai.generate_response_stream(
             user_input, emotion, conversation_history
         )
         
-        # Generate audio for AI response if voice mode is enabled
-        audio_file = None
-        if st.session_state.voice_mode:
-            audio_file = st.session_state.voice_handler.text_to_speech(ai_response)
+        # In voice mode, each sentence is synthesized as soon as it has streamed in
+        speech = st.session_state.voice_handler.speech_pipeline() if st.session_state.voice_mode else None
+        if speech:
+            response_stream = speech.feed(response_stream)
+        
+        with st.chat_message("assistant"):
+            streamed_response = st.write_stream(response_stream)
+        ai_response = st.session_state.therapeutic_ai.finalize_response(streamed_response, emotion)
+        
+        # Join the sentence audio for the AI response if voice mode is enabled
+        audio_file = speech.finish(ai_response) if speech else None
         
         # Add AI response to session
         st.session_state.session_manager.add_message('assistant', ai_response, audio_file=audio_file)
@@ -236,7 +344,7 @@ def process_user_input(user_input):
     
     finally:
         st.session_state.processing = False
-        st.rerun()
+        rerun_chat_panel()
 
 def process_voice_input():
     """Process voice input"""
@@ -258,25 +366,29 @@ def process_voice_input():
         st.error(f"Voice input error: {str(e)}")
         st.session_state.processing = False
 
+_EMOJI_MAP = {
+    'happy': '😊',
+    'sad': '😢',
+    'angry': '😠',
+    'anxious': '😰',
+    'fear': '😨',
+    'surprise': '😲',
+    'disgust': '🤢',
+    'neutral': '😐'
+}
+
 def get_emotion_emoji(emotion):
     """Get emoji for emotion"""
-    emoji_map = {
-        'happy': '😊',
-        'sad': '😢',
-        'angry': '😠',
-        'anxious': '😰',
-        'fear': '😨',
-        'surprise': '😲',
-        'disgust': '🤢',
-        'neutral': '😐'
-    }
-    return emoji_map.get(emotion.lower(), '😐')
+    return _EMOJI_MAP.get(emotion.lower() if emotion else '', '😐')
 
 def process_image_input(uploaded_file):
     """Process uploaded image input"""
-    if not st.session_state.image_analyzer:
+    # Image analysis is loaded on first upload
+    gemini_key = os.getenv("GEMINI_API_KEY", "")
+    if not gemini_key:
         st.error("Image analysis not available. Please check Gemini API configuration.")
         return
+    image_analyzer = get_image_analyzer(gemini_key)
     
     st.session_state.processing = True
     
@@ -286,28 +398,29 @@ def process_image_input(uploaded_file):
             image = uploaded_file
             st.image(image, caption="Your uploaded image", use_column_width=True)
             
-            # Analyze the image
-            image_analysis = st.session_state.image_analyzer.analyze_image_emotion(image)
+            session_manager = st.session_state.session_manager
+            therapeutic_ai = st.session_state.therapeutic_ai
+            pending = {}
             
-            # Get therapeutic content analysis
-            therapeutic_analysis = st.session_state.image_analyzer.analyze_image_content(image)
+            def start_reply(emotion):
+                # Record the image message and start the reply while the analysis finishes streaming
+                user_message = f"I shared an image that shows {emotion} emotions"
+                session_manager.add_message('user', user_message, emotion=emotion)
+                conversation_history = list(session_manager.get_conversation_context())
+                pending['reply'] = get_reply_executor().submit(
+                    therapeutic_ai.generate_response, user_message, emotion, conversation_history
+                )
             
-            # Detect faces if any
-            face_detection = st.session_state.image_analyzer.detect_faces_and_emotions(image)
+            # Analyze the image (emotion, therapeutic content, faces and suggestions)
+            image_analysis = image_analyzer.analyze_image_full(image, on_emotion=start_reply)
+            therapeutic_analysis = image_analysis['therapeutic_content']
             
-            # Generate AI response based on image
-            ai_response = st.session_state.image_analyzer.generate_image_based_response(image_analysis)
-            
-            # Add user message about sharing image
-            emotion = image_analysis['emotion']
-            user_message = f"I shared an image that shows {emotion} emotions"
-            st.session_state.session_manager.add_message('user', user_message, emotion=emotion)
+            # Cached or unstructured analyses report the emotion only at the end
+            if 'reply' not in pending:
+                start_reply(image_analysis['emotion'])
             
             # Enhance AI response with remedies
-            conversation_history = st.session_state.session_manager.get_conversation_context()
-            enhanced_response = st.session_state.therapeutic_ai.generate_response(
-                user_message, emotion, conversation_history
-            )
+            enhanced_response = pending['reply'].result()
             
             # Combine responses
             full_response = f"""Based on your image, I can see {image_analysis['analysis']}
@@ -321,37 +434,52 @@ def process_image_input(uploaded_file):
 """
             
             # Add specific suggestions
-            suggestions = st.session_state.image_analyzer.get_image_therapy_suggestions(emotion, image_analysis)
-            for suggestion in suggestions:
+            for suggestion in image_analysis['suggestions']:
                 full_response += f"• {suggestion}\n"
             
             # Add AI response to session
             st.session_state.session_manager.add_message('assistant', full_response)
             
             # Show face detection results if faces found
-            if face_detection['faces_detected'] > 0:
-                st.info(f"Detected {face_detection['faces_detected']} face(s) in the image, which helps with emotional analysis.")
+            if image_analysis['faces_detected'] > 0:
+                st.info(f"Detected {image_analysis['faces_detected']} face(s) in the image, which helps with emotional analysis.")
             
     except Exception as e:
         st.error(f"Error analyzing image: {str(e)}")
     
     finally:
         st.session_state.processing = False
-        st.rerun()
+        rerun_chat_panel()
+
+_COLOR_MAP = {
+    'happy': '#4CAF50',
+    'sad': '#2196F3',
+    'angry': '#F44336',
+    'anxious': '#FF9800',
+    'fear': '#9C27B0',
+    'surprise': '#FFEB3B',
+    'disgust': '#795548',
+    'neutral': '#9E9E9E'
+}
 
 def get_emotion_color(emotion):
     """Get color for emotion"""
-    color_map = {
-        'happy': '#4CAF50',
-        'sad': '#2196F3',
-        'angry': '#F44336',
-        'anxious': '#FF9800',
-        'fear': '#9C27B0',
-        'surprise': '#FFEB3B',
-        'disgust': '#795548',
-        'neutral': '#9E9E9E'
-    }
-    return color_map.get(emotion.lower(), '#9E9E9E')
+    return _COLOR_MAP.get(emotion.lower() if emotion else '', '#9E9E9E')
+
+_EMOTION_CSS = (
+    "<style>"
+    ".emo-ann{font-size:0.8em;color:#9E9E9E}"
+    ".mood-card{text-align:center;padding:20px;border-radius:10px;background-color:#9E9E9E20}"
+    ".mood-emoji{font-size:3em}"
+    ".mood-label{font-size:1.2em;font-weight:bold;color:#9E9E9E}"
+    + "".join(f".emo-{emotion}{{color:{color}}}.mood-{emotion}{{background-color:{color}20}}"
+              for emotion, color in _COLOR_MAP.items())
+    + "</style>"
+)
+
+def emotion_annotation(emotion):
+    """Small 'Detected emotion' label styled by the emotion classes"""
+    return f"<span class='emo-ann emo-{emotion.lower()}'>Detected emotion: {emotion}</span>"
 
 # Call main function directly
 main()
@@ -1,10 +1,18 @@
 import os
+import json
+import zlib
 import uuid
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer, Float, Boolean
+from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer, Float, Boolean, Index, LargeBinary, func, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 import streamlit as st
 
 Base = declarative_base()
@@ -29,6 +37,10 @@ class Conversation(Base):
     emotion_confidence = Column(Float, nullable=True)
     audio_file_path = Column(String(500), nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_conv_session_ts', 'user_session_id', 'timestamp'),
+    )
 
 class EmotionHistory(Base):
     __tablename__ = 'emotion_history'
@@ -41,6 +53,10 @@ class EmotionHistory(Base):
     confidence = Column(Float, nullable=True)
     detection_method = Column(String(100), nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_emotion_session_ts', 'user_session_id', 'timestamp'),
+    )
 
 class SessionStats(Base):
     __tablename__ = 'session_stats'
@@ -54,29 +70,79 @@ class SessionStats(Base):
     unique_emotions = Column(Integer, default=0)
     session_duration_minutes = Column(Float, default=0.0)
     dominant_emotion = Column(String(50), nullable=True)
+    emotion_counts = Column(JSONB, default=dict)  # emotion -> number of user messages
     last_updated = Column(DateTime, default=datetime.utcnow)
 
+class ConversationArchive(Base):
+    __tablename__ = 'conversation_archives'
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_session_id = Column(String(255), nullable=False, index=True)
+    message_count = Column(Integer, default=0)
+    payload = Column(LargeBinary, nullable=False)  # zlib-compressed JSON array of messages
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
 class DatabaseManager:
+    # Insert statements built once and reused, so every write hits SQLAlchemy's compiled cache
+    _INSERT_CONVERSATION = Conversation.__table__.insert()
+    _INSERT_EMOTION = EmotionHistory.__table__.insert()
+    
+    # Most queued turns written per background transaction
+    WRITE_BATCH_SIZE = 50
+    # Longest a queued turn waits for others to share its transaction (seconds)
+    WRITE_BATCH_DELAY = 0.2
+    # Longest flush() waits for the background writer (seconds)
+    FLUSH_TIMEOUT = 10
+    
     def __init__(self):
         """Initialize database connection"""
         self.database_url = os.getenv('DATABASE_URL')
         if not self.database_url:
             raise ValueError("DATABASE_URL environment variable is required")
         
-        self.engine = create_engine(self.database_url)
+        self.engine = create_engine(
+            self.database_url,
+            pool_size=20,
+            max_overflow=10,
+            pool_pre_ping=True,  # Detect stale connections before use
+            pool_recycle=1800
+        )
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         
         # Create tables
         Base.metadata.create_all(bind=self.engine)
+        
+        # create_all never alters existing tables; add columns and indexes introduced since they were created
+        with self.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE session_stats ADD COLUMN IF NOT EXISTS emotion_counts JSONB"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conv_session_ts ON conversations (user_session_id, timestamp)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_emotion_session_ts ON emotion_history (user_session_id, timestamp)"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_emotion_session"))
+        
+        # Write-behind queue of (message row, emotion row) turns and flush() markers, drained by a daemon thread
+        self._write_queue = queue.Queue()
+        self._write_errors = {}  # user_session_id -> last failed write
+        self._writer = threading.Thread(target=self._drain_loop, name='db-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
     
     def get_db_session(self):
         """Get database session"""
         return self.SessionLocal()
     
+    @contextmanager
+    def _session(self, db=None):
+        """Reuse the caller's session, or open a transaction that commits on exit"""
+        if db is not None:
+            yield db
+            return
+        
+        with self.SessionLocal.begin() as db:
+            yield db
+    
     def create_user_session(self, session_id: str):
         """Create or update user session"""
-        db = self.get_db_session()
-        try:
+        with self._session() as db:
             # Check if user exists
             user = db.query(User).filter(User.session_id == session_id).first()
             if not user:
@@ -91,104 +157,195 @@ class DatabaseManager:
                 stats = SessionStats(user_session_id=session_id)
                 db.add(stats)
             
-            db.commit()
+            db.flush()
             return user.id
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
+    
+    def _message_row(self, user_session_id, message_id, role, content, emotion=None,
+                     emotion_confidence=None, audio_file_path=None):
+        """Build a conversation row for a Core insert"""
+        return {
+            'id': uuid.uuid4(),
+            'user_session_id': user_session_id,
+            'message_id': message_id,
+            'role': role,
+            'content': content,
+            'emotion': emotion,
+            'emotion_confidence': emotion_confidence,
+            'audio_file_path': audio_file_path,
+            'timestamp': datetime.utcnow()
+        }
+    
+    def _emotion_row(self, user_session_id, message_id, emotion, intensity=None,
+                     confidence=None, detection_method=None):
+        """Build an emotion history row for a Core insert"""
+        return {
+            'id': uuid.uuid4(),
+            'user_session_id': user_session_id,
+            'message_id': message_id,
+            'emotion': emotion,
+            'intensity': intensity,
+            'confidence': confidence,
+            'detection_method': detection_method,
+            'timestamp': datetime.utcnow()
+        }
+    
+    def _write_rows(self, db, message_rows, emotion_rows):
+        """Insert messages and emotions with executemany and update session stats"""
+        # Core inserts skip ORM object construction and identity tracking
+        if emotion_rows:
+            db.execute(self._INSERT_EMOTION, emotion_rows)
+        
+        if message_rows:
+            db.execute(self._INSERT_CONVERSATION, message_rows)
+            
+            # Update session stats once per session in the batch
+            rows_by_session = defaultdict(list)
+            for row in message_rows:
+                rows_by_session[row['user_session_id']].append(row)
+            for user_session_id, session_rows in rows_by_session.items():
+                self._update_session_stats(db, user_session_id, session_rows)
     
     def save_message(self, user_session_id: str, message_id: str, role: str, content: str, 
-                    emotion: str = None, emotion_confidence: float = None, audio_file_path: str = None):
+                    emotion: str = None, emotion_confidence: float = None, audio_file_path: str = None, db=None):
         """Save conversation message"""
-        db = self.get_db_session()
-        try:
-            message = Conversation(
-                user_session_id=user_session_id,
-                message_id=message_id,
-                role=role,
-                content=content,
-                emotion=emotion,
-                emotion_confidence=emotion_confidence,
-                audio_file_path=audio_file_path
-            )
-            db.add(message)
-            
-            # Update session stats
-            self._update_session_stats(db, user_session_id, role, emotion)
-            
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
+        row = self._message_row(user_session_id, message_id, role, content, emotion,
+                                emotion_confidence, audio_file_path)
+        with self._session(db) as db:
+            self._write_rows(db, [row], [])
     
     def save_emotion(self, user_session_id: str, message_id: str, emotion: str, 
-                    intensity: float = None, confidence: float = None, detection_method: str = None):
+                    intensity: float = None, confidence: float = None, detection_method: str = None, db=None):
         """Save emotion detection data"""
-        db = self.get_db_session()
+        row = self._emotion_row(user_session_id, message_id, emotion, intensity, confidence, detection_method)
+        with self._session(db) as db:
+            self._write_rows(db, [], [row])
+    
+    def enqueue_turn(self, user_session_id: str, message_id: str, role: str, content: str,
+                     emotion: str = None, audio_file_path: str = None, detection_method: str = None):
+        """Queue a chat turn for the background writer and return immediately"""
+        self._write_queue.put(self._turn_rows(user_session_id, message_id, role, content,
+                                              emotion, audio_file_path, detection_method))
+    
+    def _turn_rows(self, user_session_id, message_id, role, content, emotion, audio_file_path, detection_method):
+        """Build the message row and, for user turns with an emotion, the emotion row"""
+        message_row = self._message_row(user_session_id, message_id, role, content, emotion,
+                                        audio_file_path=audio_file_path)
+        emotion_row = None
+        if emotion and role == 'user':
+            emotion_row = self._emotion_row(user_session_id, message_id, emotion,
+                                            detection_method=detection_method)
+        return message_row, emotion_row
+    
+    def _drain_loop(self):
+        """Write queued turns in batched transactions; runs on the writer thread"""
+        while True:
+            batch, markers = self._next_batch()
+            if batch:
+                self._write_batch(batch)
+            for marker in markers:
+                marker.set()
+    
+    def _next_batch(self):
+        """Collect queued turns until the batch is full, the delay passes or a flush() marker arrives"""
+        batch, markers = [], []
+        item = self._write_queue.get()
+        deadline = time.monotonic() + self.WRITE_BATCH_DELAY
+        while True:
+            if isinstance(item, threading.Event):
+                # Someone is waiting on everything queued before the marker, so write now
+                markers.append(item)
+                break
+            batch.append(item)
+            
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.WRITE_BATCH_SIZE or remaining <= 0:
+                break
+            try:
+                item = self._write_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, markers
+    
+    def _write_batch(self, batch):
+        """Write a batch in one transaction, retrying turn by turn if any row fails"""
         try:
-            emotion_entry = EmotionHistory(
-                user_session_id=user_session_id,
-                message_id=message_id,
-                emotion=emotion,
-                intensity=intensity,
-                confidence=confidence,
-                detection_method=detection_method
-            )
-            db.add(emotion_entry)
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
+            with self._session() as db:
+                self._write_rows(
+                    db,
+                    [message_row for message_row, _ in batch],
+                    [emotion_row for _, emotion_row in batch if emotion_row]
+                )
+            return
+        except Exception:
+            # One bad row rolls back the whole batch; only its own session should lose it
+            pass
+        
+        for message_row, emotion_row in batch:
+            try:
+                with self._session() as db:
+                    self._write_rows(db, [message_row], [emotion_row] if emotion_row else [])
+            except Exception as e:
+                # Surfaced to the owning session's script thread by take_write_error()
+                self._write_errors[message_row['user_session_id']] = e
+    
+    def take_write_error(self, user_session_id: str):
+        """Return and clear the last background write failure for a session, if any"""
+        return self._write_errors.pop(user_session_id, None)
+    
+    def flush(self, timeout=None):
+        """
+        Wait until every turn queued before this call has been written.
+        Gives up after FLUSH_TIMEOUT seconds by default; returns False if it did.
+        """
+        written = threading.Event()
+        self._write_queue.put(written)
+        return written.wait(self.FLUSH_TIMEOUT if timeout is None else timeout)
     
     def get_conversation_history(self, user_session_id: str, limit: int = 50):
         """Get conversation history for a user session"""
-        db = self.get_db_session()
-        try:
-            messages = db.query(Conversation).filter(
-                Conversation.user_session_id == user_session_id
-            ).order_by(Conversation.timestamp.desc()).limit(limit).all()
-            
-            return [{
-                'id': str(msg.id),
-                'message_id': msg.message_id,
-                'role': msg.role,
-                'content': msg.content,
-                'emotion': msg.emotion,
-                'emotion_confidence': msg.emotion_confidence,
-                'audio_file_path': msg.audio_file_path,
-                'timestamp': msg.timestamp.strftime("%H:%M:%S"),
-                'datetime': msg.timestamp
-            } for msg in reversed(messages)]
-        finally:
-            db.close()
+        self.flush()
+        with self._session() as db:
+            return self._conversation_rows(db, user_session_id, limit)
+    
+    def load_session_bundle(self, user_session_id: str, limit: int = 50):
+        """Load conversation history and emotion timeline over one connection and transaction"""
+        self.flush()
+        with self._session() as db:
+            return self._conversation_rows(db, user_session_id, limit), self._emotion_rows(db, user_session_id)
+    
+    def _conversation_rows(self, db, user_session_id, limit):
+        """Most recent messages of a session, oldest first"""
+        messages = db.query(Conversation).filter(
+            Conversation.user_session_id == user_session_id
+        ).order_by(Conversation.timestamp.desc()).limit(limit).all()
+        
+        return [{
+            'message_id': msg.message_id,
+            'role': msg.role,
+            'content': msg.content,
+            'emotion': msg.emotion,
+            'emotion_confidence': msg.emotion_confidence,
+            'audio_file_path': msg.audio_file_path,
+            'datetime': msg.timestamp
+        } for msg in reversed(messages)]
     
     def get_emotion_summary(self, user_session_id: str):
         """Get emotion summary for a user session"""
-        db = self.get_db_session()
-        try:
-            emotions = db.query(EmotionHistory.emotion).filter(
+        self.flush()
+        with self._session() as db:
+            emotion_counts = db.query(
+                EmotionHistory.emotion,
+                func.count(EmotionHistory.emotion)
+            ).filter(
                 EmotionHistory.user_session_id == user_session_id
-            ).all()
-            
-            emotion_counts = {}
-            for emotion in emotions:
-                emotion_name = emotion[0]
-                emotion_counts[emotion_name] = emotion_counts.get(emotion_name, 0) + 1
+            ).group_by(EmotionHistory.emotion).all()
             
-            return emotion_counts
-        finally:
-            db.close()
+            return dict(emotion_counts)
     
     def get_session_statistics(self, user_session_id: str):
         """Get session statistics"""
-        db = self.get_db_session()
-        try:
+        self.flush()
+        with self._session() as db:
             stats = db.query(SessionStats).filter(
                 SessionStats.user_session_id == user_session_id
             ).first()
@@ -213,25 +370,22 @@ class DatabaseManager:
                 'session_duration_minutes': stats.session_duration_minutes,
                 'dominant_emotion': stats.dominant_emotion
             }
-        finally:
-            db.close()
     
     def get_current_emotion(self, user_session_id: str):
         """Get the most recent emotion for a user session"""
-        db = self.get_db_session()
-        try:
-            latest_emotion = db.query(EmotionHistory).filter(
+        self.flush()
+        with self._session() as db:
+            return db.query(EmotionHistory.emotion).filter(
                 EmotionHistory.user_session_id == user_session_id
-            ).order_by(EmotionHistory.timestamp.desc()).first()
-            
-            return latest_emotion.emotion if latest_emotion else None
-        finally:
-            db.close()
+            ).order_by(EmotionHistory.timestamp.desc()).limit(1).scalar()
     
-    def clear_session_data(self, user_session_id: str):
-        """Clear all data for a user session"""
-        db = self.get_db_session()
-        try:
+    def clear_session_data(self, user_session_id: str, archive: bool = False):
+        """Clear all data for a user session, optionally archiving its conversation first"""
+        self.flush()
+        with self._session() as db:
+            if archive:
+                self._archive_conversation(db, user_session_id)
+            
             # Delete conversations
             db.query(Conversation).filter(
                 Conversation.user_session_id == user_session_id
@@ -254,63 +408,96 @@ class DatabaseManager:
                 stats.unique_emotions = 0
                 stats.session_duration_minutes = 0.0
                 stats.dominant_emotion = None
+                stats.emotion_counts = {}
                 stats.last_updated = datetime.utcnow()
-            
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
-    
-    def _update_session_stats(self, db, user_session_id: str, role: str, emotion: str = None):
-        """Update session statistics"""
+    
+    def _archive_conversation(self, db, user_session_id):
+        """Pack a session's whole conversation into one compressed archive row"""
+        rows = db.query(
+            Conversation.role,
+            Conversation.content,
+            Conversation.emotion,
+            Conversation.timestamp
+        ).filter(
+            Conversation.user_session_id == user_session_id
+        ).order_by(Conversation.timestamp).all()
+        
+        if not rows:
+            return
+        
+        fragments = [json.dumps({
+            'role': row.role,
+            'content': row.content,
+            'emotion': row.emotion,
+            'timestamp': row.timestamp.isoformat()
+        }, separators=(',', ':')) for row in rows]
+        
+        db.add(ConversationArchive(
+            user_session_id=user_session_id,
+            message_count=len(rows),
+            payload=zlib.compress(('[' + ','.join(fragments) + ']').encode('utf-8'))
+        ))
+    
+    def _update_session_stats(self, db, user_session_id: str, rows):
+        """Update session statistics for a batch of saved messages"""
         stats = db.query(SessionStats).filter(
             SessionStats.user_session_id == user_session_id
         ).first()
         
         if stats:
-            stats.total_messages += 1
-            if role == 'user':
-                stats.user_messages += 1
-                if emotion:
-                    stats.emotions_detected += 1
-            elif role == 'assistant':
-                stats.ai_messages += 1
-            
-            # Calculate unique emotions
-            unique_emotions = db.query(EmotionHistory.emotion).filter(
-                EmotionHistory.user_session_id == user_session_id
-            ).distinct().count()
-            stats.unique_emotions = unique_emotions
-            
-            # Calculate dominant emotion
-            emotion_counts = db.query(
-                EmotionHistory.emotion,
-                db.func.count(EmotionHistory.emotion).label('count')
-            ).filter(
-                EmotionHistory.user_session_id == user_session_id
-            ).group_by(EmotionHistory.emotion).order_by(db.text('count DESC')).first()
+            if stats.emotion_counts is None:
+                # Rows from before the counters existed: seed them with one GROUP BY
+                emotion_counts = dict(db.query(
+                    Conversation.emotion,
+                    func.count(Conversation.emotion)
+                ).filter(
+                    Conversation.user_session_id == user_session_id,
+                    Conversation.role == 'user',
+                    Conversation.emotion.isnot(None),
+                    Conversation.message_id.notin_([row['message_id'] for row in rows])
+                ).group_by(Conversation.emotion).all())
+            else:
+                emotion_counts = dict(stats.emotion_counts)
+            for row in rows:
+                stats.total_messages += 1
+                if row['role'] == 'user':
+                    stats.user_messages += 1
+                    if row['emotion']:
+                        stats.emotions_detected += 1
+                        emotion_counts[row['emotion']] = emotion_counts.get(row['emotion'], 0) + 1
+                elif row['role'] == 'assistant':
+                    stats.ai_messages += 1
             
+            # Derive unique and dominant emotions from the in-row counters
+            # (reassign so SQLAlchemy picks up the JSONB change)
+            stats.emotion_counts = emotion_counts
+            stats.unique_emotions = len(emotion_counts)
             if emotion_counts:
-                stats.dominant_emotion = emotion_counts[0]
+                stats.dominant_emotion = max(emotion_counts, key=emotion_counts.get)
             
             stats.last_updated = datetime.utcnow()
     
     def get_emotion_timeline(self, user_session_id: str):
         """Get emotion timeline for visualization"""
-        db = self.get_db_session()
-        try:
-            emotions = db.query(EmotionHistory).filter(
-                EmotionHistory.user_session_id == user_session_id
-            ).order_by(EmotionHistory.timestamp.asc()).all()
-            
-            return [{
-                'emotion': emotion.emotion,
-                'intensity': emotion.intensity,
-                'confidence': emotion.confidence,
-                'timestamp': emotion.timestamp,
-                'time_str': emotion.timestamp.strftime("%H:%M:%S")
-            } for emotion in emotions]
-        finally:
-            db.close()
\ No newline at end of file
+        self.flush()
+        with self._session() as db:
+            return self._emotion_rows(db, user_session_id)
+    
+    def _emotion_rows(self, db, user_session_id):
+        """Detected emotions of a session in time order"""
+        emotions = db.query(EmotionHistory).with_entities(
+            EmotionHistory.emotion,
+            EmotionHistory.intensity,
+            EmotionHistory.confidence,
+            EmotionHistory.timestamp
+        ).filter(
+            EmotionHistory.user_session_id == user_session_id
+        ).order_by(EmotionHistory.timestamp.asc()).all()
+        
+        return [{
+            'emotion': emotion.emotion,
+            'intensity': emotion.intensity,
+            'confidence': emotion.confidence,
+            'timestamp': emotion.timestamp,
+            'time_str': emotion.timestamp.strftime("%H:%M:%S")
+        } for emotion in emotions]
\ No newline at end of file
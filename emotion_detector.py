@@ -1,29 +1,50 @@
 import re
-from textblob import TextBlob
-import nltk
+import math
+import string
+from bisect import bisect_left
+from functools import lru_cache
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
+# Shared across instances so the VADER lexicon is parsed once per process
+_VADER = SentimentIntensityAnalyzer()
+
 class EmotionDetector:
+    # Emotion keywords mapping, shared by all instances
+    EMOTION_KEYWORDS = {
+        'happy': frozenset({'happy', 'joy', 'excited', 'cheerful', 'delighted', 'pleased', 'content', 'elated', 'thrilled', 'glad'}),
+        'sad': frozenset({'sad', 'depressed', 'down', 'blue', 'melancholy', 'gloomy', 'dejected', 'despondent', 'sorrowful', 'unhappy'}),
+        'angry': frozenset({'angry', 'mad', 'furious', 'irritated', 'annoyed', 'rage', 'frustrated', 'upset', 'livid', 'enraged'}),
+        'anxious': frozenset({'anxious', 'worried', 'nervous', 'stressed', 'tense', 'uneasy', 'apprehensive', 'concerned', 'restless'}),
+        'fear': frozenset({'afraid', 'scared', 'terrified', 'frightened', 'panic', 'fearful', 'alarmed', 'intimidated'}),
+        'surprise': frozenset({'surprised', 'shocked', 'amazed', 'astonished', 'stunned', 'bewildered', 'startled'}),
+        'disgust': frozenset({'disgusted', 'revolted', 'repulsed', 'sickened', 'nauseated', 'appalled'})
+    }
+    
+    # Whole-word keyword lookup over all emotions
+    KEYWORD_TO_EMOTION = {kw: emotion for emotion, keywords in EMOTION_KEYWORDS.items() for kw in keywords}
+    
     def __init__(self):
         """Initialize emotion detection with multiple analysis methods"""
-        self.vader_analyzer = SentimentIntensityAnalyzer()
-        
-        # Emotion keywords mapping
-        self.emotion_keywords = {
-            'happy': ['happy', 'joy', 'excited', 'cheerful', 'delighted', 'pleased', 'content', 'elated', 'thrilled', 'glad'],
-            'sad': ['sad', 'depressed', 'down', 'blue', 'melancholy', 'gloomy', 'dejected', 'despondent', 'sorrowful', 'unhappy'],
-            'angry': ['angry', 'mad', 'furious', 'irritated', 'annoyed', 'rage', 'frustrated', 'upset', 'livid', 'enraged'],
-            'anxious': ['anxious', 'worried', 'nervous', 'stressed', 'tense', 'uneasy', 'apprehensive', 'concerned', 'restless'],
-            'fear': ['afraid', 'scared', 'terrified', 'frightened', 'panic', 'fearful', 'alarmed', 'intimidated'],
-            'surprise': ['surprised', 'shocked', 'amazed', 'astonished', 'stunned', 'bewildered', 'startled'],
-            'disgust': ['disgusted', 'revolted', 'repulsed', 'sickened', 'nauseated', 'appalled']
-        }
-        
-        # Download required NLTK data
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt', quiet=True)
+        self.vader_analyzer = _VADER
+        
+        # Precompiled cue patterns for the sentiment-based fallbacks
+        self._anxious_re = re.compile(r'worry|stress|anxious|nervous')
+        self._angry_re = re.compile(r'angry|mad|frustrated')
+        self._vader_angry_re = re.compile(r'angry|mad')
+        
+        # VADER compound bands: <= -0.5, < -0.1, <= 0.1, above; None marks strongly negative
+        self._vader_thresholds = (-0.5, math.nextafter(-0.1, -math.inf), 0.1)
+        self._vader_bands = (None, 'sad', 'neutral', 'happy')
+        
+        # Punctuation maps to spaces; non-ASCII text falls back to the regex
+        self._punct_table = str.maketrans({c: ' ' for c in string.punctuation if c != '_'})
+        self._non_word_re = re.compile(r'\W+')
+        
+        # Memoize per-text work; the detector is shared and short messages recur
+        self._preprocess_text = lru_cache(maxsize=4096)(self._preprocess_text)
+        self._vader_scores = lru_cache(maxsize=4096)(self.vader_analyzer.polarity_scores)
+        self.detect_emotion = lru_cache(maxsize=4096)(self.detect_emotion)
+        self.get_emotion_intensity = lru_cache(maxsize=4096)(self.get_emotion_intensity)
     
     def detect_emotion(self, text):
         """
@@ -34,57 +55,48 @@ class EmotionDetector:
             return 'neutral'
         
         # Clean and preprocess text
+        lower = text.lower()
         cleaned_text = self._preprocess_text(text)
         
-        # Method 1: Keyword-based detection
+        # Method 1: Keyword-based detection takes priority when it finds something specific
         keyword_emotion = self._detect_by_keywords(cleaned_text)
-        
-        # Method 2: VADER sentiment analysis
-        vader_emotion = self._detect_by_vader(text)
-        
-        # Method 3: TextBlob sentiment analysis
-        textblob_emotion = self._detect_by_textblob(text)
-        
-        # Combine results with weights
-        emotions = [keyword_emotion, vader_emotion, textblob_emotion]
-        
-        # If keyword detection found something specific, give it priority
         if keyword_emotion != 'neutral':
             return keyword_emotion
         
-        # Otherwise, use sentiment analysis results
+        # Method 2: VADER sentiment analysis
+        vader_emotion = self._detect_by_vader(text, lower)
         if vader_emotion != 'neutral':
             return vader_emotion
         
-        return textblob_emotion
+        # Method 3: emotionally loaded wording behind a neutral overall score
+        return self._detect_by_subjectivity(text, lower)
     
     def _preprocess_text(self, text):
         """Clean and preprocess text for analysis"""
-        # Convert to lowercase
+        # Lowercase, then replace special characters and extra whitespace with single spaces
         text = text.lower()
-        
-        # Remove special characters but keep spaces
-        text = re.sub(r'[^\w\s]', ' ', text)
-        
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        
-        return text
+        if text.isascii():
+            return ' '.join(text.translate(self._punct_table).split())
+        return self._non_word_re.sub(' ', text).strip()
+    
+    def _score_keywords(self, text):
+        """
+        Match the tokens of preprocessed text against all emotion keywords
+        Returns (keyword counts, length-weighted scores) per matched emotion
+        """
+        counts = {}
+        scores = {}
+        for token in text.split():
+            emotion = self.KEYWORD_TO_EMOTION.get(token)
+            if emotion:
+                counts[emotion] = counts.get(emotion, 0) + 1
+                # Longer words get more weight
+                scores[emotion] = scores.get(emotion, 0) + len(token) / 10
+        return counts, scores
     
     def _detect_by_keywords(self, text):
         """Detect emotion based on keyword matching"""
-        emotion_scores = {}
-        
-        for emotion, keywords in self.emotion_keywords.items():
-            score = 0
-            for keyword in keywords:
-                # Count occurrences and apply weight based on word strength
-                count = text.count(keyword)
-                if count > 0:
-                    score += count * (len(keyword) / 10)  # Longer words get more weight
-            
-            if score > 0:
-                emotion_scores[emotion] = score
+        _, emotion_scores = self._score_keywords(text)
         
         if emotion_scores:
             # Return emotion with highest score
@@ -92,53 +104,30 @@ class EmotionDetector:
         
         return 'neutral'
     
-    def _detect_by_vader(self, text):
-        """Detect emotion using VADER sentiment analysis"""
-        scores = self.vader_analyzer.polarity_scores(text)
-        
-        # VADER returns compound, pos, neu, neg scores
-        compound = scores['compound']
-        pos = scores['pos']
-        neg = scores['neg']
-        
-        # Map VADER scores to emotions
-        if compound >= 0.5:
-            return 'happy'
-        elif compound <= -0.5:
-            if neg > 0.6:
-                return 'angry' if 'angry' in text.lower() or 'mad' in text.lower() else 'sad'
-            else:
-                return 'sad'
-        elif compound > 0.1:
-            return 'happy'
-        elif compound < -0.1:
-            return 'sad'
-        else:
-            return 'neutral'
+    def _detect_by_vader(self, text, lower):
+        """Detect emotion using VADER sentiment analysis (lower is text.lower())"""
+        scores = self._vader_scores(text)
+        
+        # Map the VADER compound score to an emotion band
+        emotion = self._vader_bands[bisect_left(self._vader_thresholds, scores['compound'])]
+        if emotion is None:
+            # Strongly negative: angry only when mostly negative and anger is named
+            return 'angry' if scores['neg'] > 0.6 and self._vader_angry_re.search(lower) else 'sad'
+        return emotion
     
-    def _detect_by_textblob(self, text):
-        """Detect emotion using TextBlob sentiment analysis"""
-        try:
-            blob = TextBlob(text)
-            polarity = blob.sentiment.polarity
-            subjectivity = blob.sentiment.subjectivity
-            
-            # Map polarity to emotions
-            if polarity > 0.3:
-                return 'happy'
-            elif polarity < -0.3:
-                return 'sad'
-            elif subjectivity > 0.7:
-                # High subjectivity might indicate anxiety or strong emotions
-                if any(word in text.lower() for word in ['worry', 'stress', 'anxious', 'nervous']):
-                    return 'anxious'
-                elif any(word in text.lower() for word in ['angry', 'mad', 'frustrated']):
-                    return 'angry'
-            
-            return 'neutral'
-            
-        except Exception:
-            return 'neutral'
+    def _detect_by_subjectivity(self, text, lower):
+        """Detect emotion from how much of the text carries sentiment (lower is text.lower())"""
+        # Share of non-neutral words in VADER's scoring stands in for subjectivity
+        subjectivity = 1 - self._vader_scores(text)['neu']
+        
+        if subjectivity > 0.7:
+            # High subjectivity might indicate anxiety or strong emotions
+            if self._anxious_re.search(lower):
+                return 'anxious'
+            elif self._angry_re.search(lower):
+                return 'angry'
+        
+        return 'neutral'
     
     def get_emotion_intensity(self, text):
         """Get the intensity of the detected emotion (0-1 scale)"""
@@ -147,7 +136,7 @@ class EmotionDetector:
         
         try:
             # Use VADER compound score as intensity measure
-            scores = self.vader_analyzer.polarity_scores(text)
+            scores = self._vader_scores(text)
             return abs(scores['compound'])
         except Exception:
             return 0.0
@@ -167,27 +156,16 @@ class EmotionDetector:
         
         # Keyword-based scores
         cleaned_text = self._preprocess_text(text)
-        for emotion, keywords in self.emotion_keywords.items():
-            score = 0
-            for keyword in keywords:
-                count = cleaned_text.count(keyword)
-                if count > 0:
-                    score += count
-            emotion_scores[emotion] = score
+        keyword_counts, _ = self._score_keywords(cleaned_text)
+        for emotion in self.EMOTION_KEYWORDS:
+            emotion_scores[emotion] = keyword_counts.get(emotion, 0)
         
         # VADER sentiment scores
-        vader_scores = self.vader_analyzer.polarity_scores(text)
-        
-        # TextBlob sentiment
-        try:
-            blob = TextBlob(text)
-            textblob_polarity = blob.sentiment.polarity
-        except Exception:
-            textblob_polarity = 0.0
+        vader_scores = self._vader_scores(text)
         
         # Primary emotion
         primary_emotion = self.detect_emotion(text)
-        intensity = self.get_emotion_intensity(text)
+        intensity = abs(vader_scores['compound'])
         
         # Calculate confidence based on consistency across methods
         confidence = min(1.0, intensity + 0.3) if primary_emotion != 'neutral' else 0.5
@@ -197,6 +175,5 @@ class EmotionDetector:
             'intensity': intensity,
             'confidence': confidence,
             'all_emotions': emotion_scores,
-            'vader_scores': vader_scores,
-            'textblob_polarity': textblob_polarity
+            'vader_scores': dict(vader_scores)
         }
@@ -1,34 +1,105 @@
 import base64
+import hashlib
 import io
+import json
+import re
+import threading
+import ahocorasick
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from PIL import Image
 import streamlit as st
 import cv2
 import numpy as np
 
+class _DecodedImage:
+    """An uploaded image decoded once, with its content digest and a lazily built grayscale array"""
+    def __init__(self, data):
+        self.digest = hashlib.blake2b(data, digest_size=16).digest()
+        self.pil = Image.open(io.BytesIO(data))
+        self._gray = None
+    
+    @property
+    def gray(self):
+        """Single-channel array for face detection, converted straight from the decoded image"""
+        if self._gray is None:
+            self._gray = np.asarray(self.pil.convert('L'))
+        return self._gray
+
 class ImageAnalyzer:
+    # Emotion keywords to help detect emotional content in images
+    EMOTION_KEYWORDS = {
+        'happy': frozenset({'smile', 'laughing', 'joy', 'celebration', 'bright', 'cheerful', 'excited'}),
+        'sad': frozenset({'crying', 'tears', 'frown', 'gloomy', 'dark', 'melancholy', 'upset'}),
+        'angry': frozenset({'frown', 'scowl', 'aggressive', 'tense', 'clenched', 'furious'}),
+        'anxious': frozenset({'worried', 'nervous', 'tense', 'stressed', 'fidgeting', 'restless'}),
+        'fear': frozenset({'scared', 'frightened', 'terrified', 'hiding', 'defensive'}),
+        'surprise': frozenset({'shocked', 'amazed', 'startled', 'wide-eyed', 'unexpected'}),
+        'neutral': frozenset({'calm', 'peaceful', 'serene', 'relaxed', 'content'})
+    }
+    
+    # Number of analysis results kept per process, keyed by image content
+    RESULT_CACHE_SIZE = 256
+    
     def __init__(self, gemini_api_key):
         """Initialize image analyzer with Gemini Pro Vision"""
         self.gemini_api_key = gemini_api_key
         genai.configure(api_key=self.gemini_api_key)
         self.model = genai.GenerativeModel('gemini-pro-vision')
         
-        # Emotion keywords to help detect emotional content in images
-        self.emotion_keywords = {
-            'happy': ['smile', 'laughing', 'joy', 'celebration', 'bright', 'cheerful', 'excited'],
-            'sad': ['crying', 'tears', 'frown', 'gloomy', 'dark', 'melancholy', 'upset'],
-            'angry': ['frown', 'scowl', 'aggressive', 'tense', 'clenched', 'furious'],
-            'anxious': ['worried', 'nervous', 'tense', 'stressed', 'fidgeting', 'restless'],
-            'fear': ['scared', 'frightened', 'terrified', 'hiding', 'defensive'],
-            'surprise': ['shocked', 'amazed', 'startled', 'wide-eyed', 'unexpected'],
-            'neutral': ['calm', 'peaceful', 'serene', 'relaxed', 'content']
+        # Fallback cues, checked in priority order
+        self._fallback_cues = {
+            'happy': ['happy', 'joy', 'smile', 'positive'],
+            'sad': ['sad', 'cry', 'tear', 'down'],
+            'angry': ['angry', 'mad', 'furious', 'aggressive'],
+            'anxious': ['anxious', 'worry', 'nervous', 'stress'],
+            'fear': ['fear', 'scared', 'afraid', 'frightened'],
+            'surprise': ['surprise', 'shock', 'amaze', 'startled']
         }
+        
+        # One automaton finds explicit mentions, keywords and fallback cues in a single scan
+        tags = {}
+        for emotion, keywords in self.EMOTION_KEYWORDS.items():
+            tags.setdefault(f"emotion: {emotion}", []).append(('explicit', emotion))
+            for keyword in keywords:
+                tags.setdefault(keyword, []).append(('keyword', emotion))
+        for emotion, cues in self._fallback_cues.items():
+            for cue in cues:
+                tags.setdefault(cue, []).append(('fallback', emotion))
+        self._analysis_automaton = ahocorasick.Automaton()
+        for word, word_tags in tags.items():
+            self._analysis_automaton.add_word(word, (word, word_tags))
+        self._analysis_automaton.make_automaton()
+        
+        # Face detection cascade is loaded once and shared across calls
+        try:
+            self._face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        except Exception:
+            self._face_cascade = None
+        self._face_lock = threading.Lock()
+        
+        # Leading "emotion" field of a streamed analysis (JSON key or "Emotion:" line)
+        self._emotion_field_re = re.compile(r'"?emotion"?\s*:\s*"?([a-z]+)\W', re.I)
+        self._conf_re = re.compile(r'confidence: (high|medium|low)', re.I)
+        
+        # Shared worker pool for local work that overlaps the Gemini calls
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        
+        # Gemini results keyed by a digest of the uploaded bytes
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
     
     def analyze_image_emotion(self, image_file):
         """Analyze emotional content in an image"""
         try:
             # Convert uploaded file to PIL Image
-            image = Image.open(image_file)
+            decoded = self._decode(image_file)
+            cache_key = (decoded.digest, 'emotion')
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return dict(cached)
+            image = decoded.pil
             
             # Prepare the prompt for emotional analysis
             prompt = """Analyze this image for emotional content. Consider:
@@ -53,11 +124,13 @@ class ImageAnalyzer:
             # Parse the response to extract emotion
             emotion = self._extract_emotion_from_analysis(analysis_text)
             
-            return {
+            result = {
                 'emotion': emotion,
                 'analysis': analysis_text,
                 'confidence': self._extract_confidence(analysis_text)
             }
+            self._cache_put(cache_key, result)
+            return dict(result)
             
         except Exception as e:
             return {
@@ -69,7 +142,12 @@ class ImageAnalyzer:
     def analyze_image_content(self, image_file, user_context=None):
         """Analyze image content for therapeutic context"""
         try:
-            image = Image.open(image_file)
+            decoded = self._decode(image_file)
+            cache_key = (decoded.digest, 'content', user_context)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+            image = decoded.pil
             
             context_prompt = ""
             if user_context:
@@ -87,52 +165,178 @@ class ImageAnalyzer:
             Be empathetic and focus on emotional support rather than just description."""
             
             response = self.model.generate_content([prompt, image])
+            self._cache_put(cache_key, response.text)
             return response.text
             
         except Exception as e:
             return f"I can see you've shared an image with me. While I had trouble analyzing the specific details, I'm here to support you. Would you like to tell me about what this image means to you or how it makes you feel?"
     
+    def analyze_image_full(self, image_file, user_context=None, on_emotion=None):
+        """
+        Analyze emotion and therapeutic content of an image with a single Gemini call
+        The response is streamed; on_emotion(emotion) is called as soon as the emotion is known
+        """
+        early_emotion = None
+        try:
+            decoded = self._decode(image_file)
+            cache_key = (decoded.digest, 'full', user_context)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return dict(cached)
+            image = decoded.pil
+            
+            context_prompt = ""
+            if user_context:
+                context_prompt = f"The user shared this context: '{user_context}'"
+            
+            prompt = f"""As an AI therapy assistant, analyze this image for emotional content and emotional wellbeing.
+            {context_prompt}
+            
+            Consider facial expressions and body language, colors, lighting and mood of the scene,
+            objects or symbols that might convey emotions, and the overall atmosphere.
+            
+            Return only a JSON object with these keys:
+            "emotion": the primary emotion conveyed (one of happy, sad, angry, anxious, fear, surprise, neutral)
+            "confidence": how confident you are (high, medium or low)
+            "analysis": a brief description of what you see and the visual cues that indicate this emotion
+            "therapeutic_content": a compassionate description of the emotional themes, therapeutic observations
+            and supportive reflections about what this image might mean to someone
+            
+            Be empathetic and focus on emotional support rather than just description."""
+            
+            # Run local face detection while waiting on the Gemini call
+            image.load()
+            faces_future = self._executor.submit(self._detect_faces, decoded)
+            try:
+                chunks = []
+                for chunk in self.model.generate_content([prompt, image], stream=True):
+                    chunks.append(chunk.text)
+                    if on_emotion and early_emotion is None:
+                        match = self._emotion_field_re.search(''.join(chunks))
+                        if match and match.group(1).lower() in self.EMOTION_KEYWORDS:
+                            early_emotion = match.group(1).lower()
+                            on_emotion(early_emotion)
+                result = self._parse_full_analysis(''.join(chunks))
+            finally:
+                face_detection = faces_future.result()
+            
+            # Keep the emotion that was already reported to the caller
+            if early_emotion:
+                result['emotion'] = early_emotion
+            
+            result.update(face_detection)
+            result['suggestions'] = self.get_image_therapy_suggestions(result['emotion'], result)
+            self._cache_put(cache_key, result)
+            return dict(result)
+            
+        except Exception as e:
+            result = {
+                'emotion': early_emotion or 'neutral',
+                'analysis': f"Unable to analyze image: {str(e)}",
+                'confidence': 'low',
+                'therapeutic_content': "I can see you've shared an image with me. While I had trouble analyzing the specific details, I'm here to support you. Would you like to tell me about what this image means to you or how it makes you feel?"
+            }
+            face_detection = {'faces_detected': 0, 'face_locations': []}
+        
+        result.update(face_detection)
+        result['suggestions'] = self.get_image_therapy_suggestions(result['emotion'], result)
+        return result
+    
+    def _read_bytes(self, image_file):
+        """Read the raw bytes of an uploaded image without consuming the upload"""
+        if hasattr(image_file, 'getvalue'):
+            return image_file.getvalue()
+        data = image_file.read()
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
+        return data
+    
+    def _decode(self, image_file):
+        """Decode an upload once; already decoded images are passed through"""
+        if isinstance(image_file, _DecodedImage):
+            return image_file
+        return _DecodedImage(self._read_bytes(image_file))
+    
+    def _cache_get(self, key):
+        """Look up a cached analysis and mark it recently used"""
+        with self._cache_lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+    
+    def _cache_put(self, key, value):
+        """Store an analysis, evicting the least recently used beyond the limit"""
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.RESULT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+    
+    def _parse_full_analysis(self, response_text):
+        """Parse the JSON response of analyze_image_full, falling back to text extraction"""
+        try:
+            # The model may wrap the JSON in a code fence
+            data = json.loads(response_text[response_text.index('{'):response_text.rindex('}') + 1])
+        except ValueError:
+            return {
+                'emotion': self._extract_emotion_from_analysis(response_text),
+                'analysis': response_text,
+                'confidence': self._extract_confidence(response_text),
+                'therapeutic_content': response_text
+            }
+        
+        emotion = str(data.get('emotion', '')).lower()
+        if emotion not in self.EMOTION_KEYWORDS:
+            emotion = self._extract_emotion_from_analysis(f"emotion: {emotion}\n{data.get('analysis', '')}")
+        
+        confidence = str(data.get('confidence', '')).lower()
+        if confidence not in ('high', 'medium', 'low'):
+            confidence = 'medium'
+        
+        return {
+            'emotion': emotion,
+            'analysis': data.get('analysis', ''),
+            'confidence': confidence,
+            'therapeutic_content': data.get('therapeutic_content', '')
+        }
+    
     def _extract_emotion_from_analysis(self, analysis_text):
         """Extract primary emotion from analysis text"""
         analysis_lower = analysis_text.lower()
         
+        # Collect every match in one pass
+        explicit = set()
+        keyword_hits = {}
+        fallback = set()
+        for _, (word, word_tags) in self._analysis_automaton.iter(analysis_lower):
+            for kind, emotion in word_tags:
+                if kind == 'explicit':
+                    explicit.add(emotion)
+                elif kind == 'keyword':
+                    keyword_hits.setdefault(emotion, set()).add(word)
+                else:
+                    fallback.add(emotion)
+        
         # Look for explicit emotion mentions
-        for emotion, keywords in self.emotion_keywords.items():
-            if f"emotion: {emotion}" in analysis_lower:
+        for emotion in self.EMOTION_KEYWORDS:
+            if emotion in explicit:
                 return emotion
             
             # Count keyword matches
-            keyword_count = sum(1 for keyword in keywords if keyword in analysis_lower)
-            if keyword_count >= 2:  # If multiple keywords match
+            if len(keyword_hits.get(emotion, ())) >= 2:  # If multiple keywords match
                 return emotion
         
         # Default fallback
-        if any(word in analysis_lower for word in ['happy', 'joy', 'smile', 'positive']):
-            return 'happy'
-        elif any(word in analysis_lower for word in ['sad', 'cry', 'tear', 'down']):
-            return 'sad'
-        elif any(word in analysis_lower for word in ['angry', 'mad', 'furious', 'aggressive']):
-            return 'angry'
-        elif any(word in analysis_lower for word in ['anxious', 'worry', 'nervous', 'stress']):
-            return 'anxious'
-        elif any(word in analysis_lower for word in ['fear', 'scared', 'afraid', 'frightened']):
-            return 'fear'
-        elif any(word in analysis_lower for word in ['surprise', 'shock', 'amaze', 'startled']):
-            return 'surprise'
-        else:
-            return 'neutral'
+        for emotion in self._fallback_cues:
+            if emotion in fallback:
+                return emotion
+        return 'neutral'
     
     def _extract_confidence(self, analysis_text):
         """Extract confidence level from analysis"""
-        analysis_lower = analysis_text.lower()
-        if 'confidence: high' in analysis_lower:
-            return 'high'
-        elif 'confidence: medium' in analysis_lower:
-            return 'medium'
-        elif 'confidence: low' in analysis_lower:
-            return 'low'
-        else:
-            return 'medium'  # default
+        match = self._conf_re.search(analysis_text)
+        return match.group(1).lower() if match else 'medium'  # default
     
     def generate_image_based_response(self, image_analysis, user_message=None):
         """Generate therapeutic response based on image analysis"""
@@ -165,18 +369,28 @@ class ImageAnalyzer:
     def detect_faces_and_emotions(self, image_file):
         """Detect faces in image using OpenCV (basic emotion detection)"""
         try:
-            # Convert PIL image to OpenCV format
-            image = Image.open(image_file)
-            opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            # Load face detection cascade
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            decoded = self._decode(image_file)
+        except Exception as e:
+            return {
+                'faces_detected': 0,
+                'face_locations': [],
+                'error': str(e)
+            }
+        
+        return self._detect_faces(decoded)
+    
+    def _detect_faces(self, decoded):
+        """Detect faces in a decoded image"""
+        try:
+            if self._face_cascade is None:
+                raise RuntimeError("Face detection cascade is unavailable")
             
-            # Convert to grayscale for face detection
-            gray = cv2.cvtColor(opencv_image, cv2.COLOR_BGR2GRAY)
+            # Grayscale view of the decoded image
+            gray = decoded.gray
             
-            # Detect faces
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            # Detect faces (the shared classifier is not safe to run concurrently)
+            with self._face_lock:
+                faces = self._face_cascade.detectMultiScale(gray, 1.1, 4)
             
             return {
                 'faces_detected': len(faces),
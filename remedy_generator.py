@@ -1,6 +1,13 @@
 import random
+import time
+from functools import lru_cache
 from typing import Dict, List
 
+def _pick(pool, k, rng=random):
+    """Pick up to k distinct items from a tuple pool"""
+    n = len(pool)
+    return [pool[i] for i in rng.sample(range(n), min(k, n))] if n else []
+
 class RemedyGenerator:
     def __init__(self):
         """Initialize remedy generator with comprehensive therapeutic techniques"""
@@ -162,26 +169,35 @@ class RemedyGenerator:
                 "Try mantra meditation with calming phrases"
             ]
         }
+        
+        # Per-emotion remedy pools, precomputed once; missing buckets are empty tuples
+        self._remedy_index = {
+            emotion: (
+                tuple(immediate),
+                tuple(self.physical_remedies.get(emotion, ())),
+                tuple(self.cognitive_remedies.get(emotion, ())),
+                tuple(self.mindfulness_remedies.get(emotion, ())),
+                tuple(self.long_term_strategies.get(emotion, ()))
+            )
+            for emotion, immediate in self.immediate_remedies.items()
+        }
+        
+        # Formatted responses are stable within an hour, so repeats are a cache hit
+        self._format_for_hour = lru_cache(maxsize=128)(self._format_for_hour)
     
-    def get_comprehensive_remedy(self, emotion: str, situation: str = None) -> Dict[str, List[str]]:
-        """Get a comprehensive remedy package for the given emotion"""
+    def get_comprehensive_remedy(self, emotion: str, situation: str = None, rng=random) -> Dict[str, List[str]]:
+        """Get a comprehensive remedy package for the given emotion (rng defaults to the random module)"""
         emotion = emotion.lower()
         
         # Default to neutral if emotion not found
-        if emotion not in self.immediate_remedies:
-            emotion = 'neutral'
+        immediate, physical, cognitive, mindfulness, long_term = self._remedy_index.get(emotion, self._remedy_index['neutral'])
         
         remedy_package = {
-            'immediate': random.sample(self.immediate_remedies.get(emotion, self.immediate_remedies['neutral']), 
-                                     min(2, len(self.immediate_remedies.get(emotion, self.immediate_remedies['neutral'])))),
-            'physical': random.sample(self.physical_remedies.get(emotion, []), 
-                                    min(2, len(self.physical_remedies.get(emotion, [])))),
-            'cognitive': random.sample(self.cognitive_remedies.get(emotion, []), 
-                                     min(2, len(self.cognitive_remedies.get(emotion, [])))),
-            'mindfulness': random.sample(self.mindfulness_remedies.get(emotion, []), 
-                                       min(1, len(self.mindfulness_remedies.get(emotion, [])))),
-            'long_term': random.sample(self.long_term_strategies.get(emotion, []), 
-                                     min(2, len(self.long_term_strategies.get(emotion, []))))
+            'immediate': _pick(immediate, 2, rng),
+            'physical': _pick(physical, 2, rng),
+            'cognitive': _pick(cognitive, 2, rng),
+            'mindfulness': [rng.choice(mindfulness)] if mindfulness else [],
+            'long_term': _pick(long_term, 2, rng)
         }
         
         return remedy_package
@@ -193,35 +209,24 @@ class RemedyGenerator:
         return random.choice(remedies)
     
     def format_remedy_response(self, emotion: str, situation: str = None) -> str:
-        """Format a complete remedy response"""
-        remedies = self.get_comprehensive_remedy(emotion, situation)
-        
-        response = f"Here are some practical techniques to help with {emotion} feelings:\n\n"
-        
-        response += "🚨 **Try Right Now:**\n"
-        for remedy in remedies['immediate']:
-            response += f"• {remedy}\n"
-        
-        if remedies['physical']:
-            response += "\n💪 **Physical Techniques:**\n"
-            for remedy in remedies['physical']:
-                response += f"• {remedy}\n"
-        
-        if remedies['cognitive']:
-            response += "\n🧠 **Mental Strategies:**\n"
-            for remedy in remedies['cognitive']:
-                response += f"• {remedy}\n"
+        """Format a complete remedy response; the selection rotates hourly"""
+        return self._format_for_hour(emotion, situation, int(time.time() // 3600))
+    
+    def _format_for_hour(self, emotion: str, situation: str, hour: int) -> str:
+        """Format the remedy response for one hour bucket, seeded by the hour"""
+        remedies = self.get_comprehensive_remedy(emotion, situation, random.Random(hour))
         
-        if remedies['mindfulness']:
-            response += "\n🧘 **Mindfulness Practice:**\n"
-            for remedy in remedies['mindfulness']:
-                response += f"• {remedy}\n"
+        parts = [f"Here are some practical techniques to help with {emotion} feelings:\n\n", "🚨 **Try Right Now:**\n"]
+        parts.extend(f"• {remedy}\n" for remedy in remedies['immediate'])
         
-        if remedies['long_term']:
-            response += "\n📈 **For Long-term Wellbeing:**\n"
-            for remedy in remedies['long_term']:
-                response += f"• {remedy}\n"
+        for key, heading in (('physical', "💪 **Physical Techniques:**"),
+                             ('cognitive', "🧠 **Mental Strategies:**"),
+                             ('mindfulness', "🧘 **Mindfulness Practice:**"),
+                             ('long_term', "📈 **For Long-term Wellbeing:**")):
+            if remedies[key]:
+                parts.append(f"\n{heading}\n")
+                parts.extend(f"• {remedy}\n" for remedy in remedies[key])
         
-        response += "\nRemember: Start with one technique that feels manageable. You don't need to try everything at once."
+        parts.append("\nRemember: Start with one technique that feels manageable. You don't need to try everything at once.")
         
-        return response
\ No newline at end of file
+        return ''.join(parts)
\ No newline at end of file
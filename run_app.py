@@ -6,22 +6,27 @@ Simple launcher script for the therapy chatbot
 
 import os
 import sys
-import subprocess
+import traceback
+from functools import lru_cache
 from pathlib import Path
 
+@lru_cache(maxsize=1)
+def _gemini_key():
+    """Gemini API key, reading .env only when the environment is not already configured"""
+    if not (os.environ.get("GEMINI_API_KEY") and os.environ.get("DATABASE_URL")):
+        from dotenv import load_dotenv
+        load_dotenv()
+    return os.environ.get("GEMINI_API_KEY")
+
 def check_environment():
     """Check if environment is set up properly"""
-    env_file = Path(".env")
-    if not env_file.exists():
+    if not os.environ.get("GEMINI_API_KEY") and not Path(".env").exists():
         print("⚠️  .env file not found")
         print("   Run setup.py first or copy .env.example to .env")
         return False
     
     # Check if Gemini API key is set
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    gemini_key = os.getenv("GEMINI_API_KEY")
+    gemini_key = _gemini_key()
     if not gemini_key or gemini_key == "your_gemini_api_key_here":
         print("⚠️  Gemini API key not configured")
         print("   Please edit .env file and add your Gemini API key")
@@ -40,20 +45,33 @@ def main():
         print("   Run python setup.py to configure the environment")
         sys.exit(1)
     
-    # Launch Streamlit app
+    # Launch Streamlit app in this process (the .env loaded above is already in os.environ)
+    try:
+        from streamlit.web import bootstrap
+    except ImportError:
+        print("❌ Streamlit not found")
+        print("   Install with: pip install streamlit")
+        return
+    
     try:
         print("🚀 Launching Streamlit application...")
         print("   Opening in browser at: http://localhost:8501")
-        subprocess.run(["streamlit", "run", "app.py"], check=True)
-    except subprocess.CalledProcessError:
-        print("❌ Failed to start Streamlit")
-        print("   Make sure all dependencies are installed")
-        print("   Run: pip install -r requirements.txt")
+        if not Path("app.py").exists():
+            raise FileNotFoundError("app.py")
+        bootstrap.load_config_options(flag_options={})
+        bootstrap.run("app.py", is_hello=False, args=[], flag_options={})
     except KeyboardInterrupt:
         print("\n👋 Shutting down AI Therapy Chatbot")
     except FileNotFoundError:
-        print("❌ Streamlit not found")
-        print("   Install with: pip install streamlit")
+        print("❌ app.py not found")
+        print("   Run this launcher from the project directory")
+    except Exception as e:
+        # Streamlit runs in this process, so its error is not printed anywhere else
+        traceback.print_exc()
+        print(f"❌ Failed to start Streamlit: {e}")
+        print("   Make sure all dependencies are installed")
+        print("   Run: pip install -r requirements.txt")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,34 @@
+import os
+import json
+import time
 import uuid
+import operator
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
+from itertools import islice
 import streamlit as st
 from database import DatabaseManager
 
+@st.cache_resource
+def _get_db():
+    """Get the shared database manager (one connection pool and writer per process)"""
+    return DatabaseManager()
+
 class SessionManager:
-    def __init__(self):
+    # Bounds on what a session keeps in memory; older entries are evicted
+    MAX_MESSAGES = 50
+    MAX_EMOTIONS = 200
+    # Seconds before an identical database warning may be shown again
+    WARNING_COOLDOWN = 60
+    
+    def __init__(self, persist_assistant=None):
         """Initialize session manager with database support"""
+        # Assistant replies can be skipped in the database to halve write volume;
+        # they then live only in memory and are gone after a reload
+        if persist_assistant is None:
+            persist_assistant = os.getenv('PERSIST_ASSISTANT_MESSAGES', 'true').lower() not in ('0', 'false', 'no')
+        self.persist_assistant = persist_assistant
+        
         if 'session_id' not in st.session_state:
             st.session_state.session_id = str(uuid.uuid4())
         
@@ -15,36 +37,91 @@ class SessionManager:
         
         # Initialize database manager
         try:
-            self.db = DatabaseManager()
+            self.db = _get_db()
             # Create user session in database
             self.db.create_user_session(st.session_state.session_id)
             
-            # Load existing data from database
-            if 'messages' not in st.session_state:
-                st.session_state.messages = self.db.get_conversation_history(st.session_state.session_id)
-            
-            if 'emotions_history' not in st.session_state:
-                st.session_state.emotions_history = self.db.get_emotion_timeline(st.session_state.session_id)
+            # Load existing data from database in one round trip
+            if 'messages' not in st.session_state or 'emotions_history' not in st.session_state:
+                messages, emotions = self.db.load_session_bundle(st.session_state.session_id, self.MAX_MESSAGES)
+                if 'messages' not in st.session_state:
+                    st.session_state.messages = deque(messages, maxlen=self.MAX_MESSAGES)
+                if 'emotions_history' not in st.session_state:
+                    st.session_state.emotions_history = deque(emotions, maxlen=self.MAX_EMOTIONS)
                 
         except Exception as e:
             st.error(f"Database connection failed: {str(e)}")
             # Fallback to in-memory storage
             self.db = None
             if 'messages' not in st.session_state:
-                st.session_state.messages = []
+                st.session_state.messages = deque(maxlen=self.MAX_MESSAGES)
             if 'emotions_history' not in st.session_state:
-                st.session_state.emotions_history = []
+                st.session_state.emotions_history = deque(maxlen=self.MAX_EMOTIONS)
+        
+        # Running emotion tallies, kept up to date by add_message
+        if 'emotion_counter' not in st.session_state:
+            emotions = [entry['emotion'] for entry in st.session_state.emotions_history]
+            st.session_state.emotion_counter = Counter(emotions)
+            st.session_state.emotion_changes = sum(map(operator.ne, emotions, emotions[1:]))
+            st.session_state.last_emotion = emotions[-1] if emotions else None
+        
+        # Visualization rows, appended as emotions arrive instead of rebuilt per rerun
+        if 'emotion_timeline_cache' not in st.session_state:
+            st.session_state.emotion_timeline_cache = deque(
+                (self._timeline_entry(entry['emotion'], entry['timestamp']) for entry in st.session_state.emotions_history),
+                maxlen=self.MAX_EMOTIONS
+            )
+        
+        # Pre-serialized export entries, one per message in st.session_state.messages
+        if 'export_fragments' not in st.session_state:
+            st.session_state.export_fragments = deque(
+                map(self._export_fragment, st.session_state.messages),
+                maxlen=self.MAX_MESSAGES
+            )
+    
+    def _export_fragment(self, msg):
+        """Serialize one message as a compact JSON export entry"""
+        conversation_entry = {
+            'role': msg['role'],
+            'content': msg['content'],
+            'timestamp': msg['datetime'].strftime("%H:%M:%S")
+        }
+        
+        if 'emotion' in msg:
+            conversation_entry['emotion'] = msg['emotion']
+        
+        return json.dumps(conversation_entry, separators=(',', ':'))
+    
+    def _warn_once(self, msg):
+        """Show a database warning unless the same one was shown within WARNING_COOLDOWN"""
+        seen = st.session_state.setdefault('_seen_db_errors', {})  # message hash -> last shown
+        key = hash(msg)
+        now = time.monotonic()
+        if now - seen.get(key, float('-inf')) < self.WARNING_COOLDOWN:
+            return
+        
+        seen[key] = now
+        st.warning(msg)
+    
+    def _timeline_entry(self, emotion, timestamp):
+        """Build a timeline row for one detected emotion"""
+        return {
+            'emotion': emotion,
+            'timestamp': timestamp,
+            'time_str': timestamp.strftime("%H:%M:%S"),
+            'minutes_since_start': (timestamp - st.session_state.session_start_time).total_seconds() / 60
+        }
     
     def add_message(self, role, content, emotion=None, audio_file=None):
         """Add a message to the conversation history"""
         message_id = str(uuid.uuid4())
+        now = datetime.now()
+        # Display strings are formatted from 'datetime' when rendered or exported
         message = {
-            'id': message_id,
             'message_id': message_id,
             'role': role,  # 'user' or 'assistant'
             'content': content,
-            'timestamp': datetime.now().strftime("%H:%M:%S"),
-            'datetime': datetime.now()
+            'datetime': now
         }
         
         if emotion and role == 'user':
@@ -52,45 +129,40 @@ class SessionManager:
             # Track emotion history
             emotion_entry = {
                 'emotion': emotion,
-                'timestamp': datetime.now(),
+                'timestamp': now,
                 'message_id': message_id
             }
             st.session_state.emotions_history.append(emotion_entry)
-            
-            # Save emotion to database
-            if self.db:
-                try:
-                    self.db.save_emotion(
-                        st.session_state.session_id,
-                        message_id,
-                        emotion,
-                        detection_method='multi_method'
-                    )
-                except Exception as e:
-                    st.warning(f"Failed to save emotion to database: {str(e)}")
+            st.session_state.emotion_counter[emotion] += 1
+            if st.session_state.last_emotion is not None and emotion != st.session_state.last_emotion:
+                st.session_state.emotion_changes += 1
+            st.session_state.last_emotion = emotion
+            st.session_state.emotion_timeline_cache.append(self._timeline_entry(emotion, now))
         
         if audio_file:
             message['audio_file'] = audio_file
         
-        # Save message to database
+        # Queue emotion and message for the background database writer
         if self.db:
-            try:
-                self.db.save_message(
+            if role == 'user' or self.persist_assistant:
+                self.db.enqueue_turn(
                     st.session_state.session_id,
                     message_id,
                     role,
                     content,
                     emotion,
-                    audio_file_path=audio_file
+                    audio_file_path=audio_file,
+                    detection_method='multi_method'
                 )
-            except Exception as e:
-                st.warning(f"Failed to save message to database: {str(e)}")
+            
+            # Writes happen off the script thread; report failures here where the UI is available
+            write_error = self.db.take_write_error(st.session_state.session_id)
+            if write_error:
+                self._warn_once(f"Failed to save message to database: {str(write_error)}")
         
+        # Bounded deque drops the oldest message past MAX_MESSAGES
         st.session_state.messages.append(message)
-        
-        # Limit message history to prevent memory issues (keep last 50 messages)
-        if len(st.session_state.messages) > 50:
-            st.session_state.messages = st.session_state.messages[-50:]
+        st.session_state.export_fragments.append(self._export_fragment(message))
     
     def get_messages(self):
         """Get all messages in the current session"""
@@ -98,19 +170,14 @@ class SessionManager:
     
     def get_conversation_context(self, max_messages=10):
         """Get recent conversation context for AI"""
+        # Copy only the tail of the deque rather than all of it
         messages = st.session_state.messages
-        if len(messages) <= max_messages:
-            return messages
-        return messages[-max_messages:]
+        n = len(messages)
+        return list(islice(messages, max(0, n - max_messages), n))
     
     def get_current_emotion(self):
         """Get the most recent emotion detected"""
-        if self.db:
-            try:
-                return self.db.get_current_emotion(st.session_state.session_id)
-            except Exception:
-                pass
-        
+        # Session state mirrors this session's database rows, so reruns need no query
         if not st.session_state.emotions_history:
             return None
         
@@ -119,44 +186,25 @@ class SessionManager:
     
     def get_emotions_summary(self):
         """Get a summary of emotions in the current session"""
-        if self.db:
-            try:
-                return self.db.get_emotion_summary(st.session_state.session_id)
-            except Exception:
-                pass
-        
-        if not st.session_state.emotions_history:
-            return {}
-        
-        emotions = [entry['emotion'] for entry in st.session_state.emotions_history]
-        return dict(Counter(emotions))
+        return dict(st.session_state.emotion_counter)
     
     def get_emotion_timeline(self):
         """Get emotion timeline for visualization"""
-        if not st.session_state.emotions_history:
-            return []
-        
-        timeline = []
-        for entry in st.session_state.emotions_history:
-            timeline.append({
-                'emotion': entry['emotion'],
-                'timestamp': entry['timestamp'],
-                'time_str': entry['timestamp'].strftime("%H:%M:%S")
-            })
-        
-        return timeline
+        return list(st.session_state.emotion_timeline_cache)
     
     def get_session_stats(self):
         """Get session statistics"""
         current_time = datetime.now()
         session_duration = current_time - st.session_state.session_start_time
         
-        message_count = len(st.session_state.messages)
-        user_messages = len([msg for msg in st.session_state.messages if msg['role'] == 'user'])
-        ai_messages = len([msg for msg in st.session_state.messages if msg['role'] == 'assistant'])
+        # Count roles in a single pass
+        roles = Counter(msg['role'] for msg in st.session_state.messages)
+        message_count = sum(roles.values())
+        user_messages = roles['user']
+        ai_messages = roles['assistant']
         
-        emotions_detected = len(st.session_state.emotions_history)
-        unique_emotions = len(set(entry['emotion'] for entry in st.session_state.emotions_history))
+        emotions_detected = sum(st.session_state.emotion_counter.values())
+        unique_emotions = len(st.session_state.emotion_counter)
         
         return {
             'session_id': st.session_state.session_id,
@@ -175,13 +223,18 @@ class SessionManager:
         # Clear database data
         if self.db:
             try:
-                self.db.clear_session_data(st.session_state.session_id)
+                self.db.clear_session_data(st.session_state.session_id, archive=True)
             except Exception as e:
-                st.warning(f"Failed to clear database session: {str(e)}")
+                self._warn_once(f"Failed to clear database session: {str(e)}")
         
         # Clear session state
-        st.session_state.messages = []
-        st.session_state.emotions_history = []
+        st.session_state.messages = deque(maxlen=self.MAX_MESSAGES)
+        st.session_state.export_fragments = deque(maxlen=self.MAX_MESSAGES)
+        st.session_state.emotions_history = deque(maxlen=self.MAX_EMOTIONS)
+        st.session_state.emotion_counter = Counter()
+        st.session_state.emotion_changes = 0
+        st.session_state.last_emotion = None
+        st.session_state.emotion_timeline_cache = deque(maxlen=self.MAX_EMOTIONS)
         st.session_state.session_start_time = datetime.now()
         old_session_id = st.session_state.session_id
         st.session_state.session_id = str(uuid.uuid4())
@@ -191,37 +244,25 @@ class SessionManager:
             try:
                 self.db.create_user_session(st.session_state.session_id)
             except Exception as e:
-                st.warning(f"Failed to create new database session: {str(e)}")
+                self._warn_once(f"Failed to create new database session: {str(e)}")
     
     def export_conversation(self):
-        """Export conversation history as a dictionary"""
+        """Export conversation history as a JSON string"""
         stats = self.get_session_stats()
         emotions_summary = self.get_emotions_summary()
         
-        export_data = {
+        envelope = json.dumps({
             'session_info': {
                 'session_id': stats['session_id'],
                 'start_time': stats['session_start'].isoformat(),
                 'duration_minutes': stats['duration_minutes'],
                 'message_count': stats['message_count']
             },
-            'emotions_summary': emotions_summary,
-            'conversation': []
-        }
-        
-        for msg in st.session_state.messages:
-            conversation_entry = {
-                'role': msg['role'],
-                'content': msg['content'],
-                'timestamp': msg['timestamp']
-            }
-            
-            if 'emotion' in msg:
-                conversation_entry['emotion'] = msg['emotion']
-            
-            export_data['conversation'].append(conversation_entry)
+            'emotions_summary': emotions_summary
+        }, separators=(',', ':'))
         
-        return export_data
+        # Messages were serialized as they arrived; splice them into the envelope
+        return envelope[:-1] + ',"conversation":[' + ','.join(st.session_state.export_fragments) + ']}'
     
     def get_emotional_insights(self):
         """Generate insights about emotional patterns"""
@@ -232,30 +273,25 @@ class SessionManager:
                 'emotion_changes': 0
             }
         
-        emotions = [entry['emotion'] for entry in st.session_state.emotions_history]
-        emotion_counts = Counter(emotions)
+        emotion_counts = st.session_state.emotion_counter
         
         # Dominant emotion
-        dominant_emotion = emotion_counts.most_common(1)[0][0]
-        dominant_count = emotion_counts.most_common(1)[0][1]
+        dominant_emotion, dominant_count = emotion_counts.most_common(1)[0]
         
-        # Emotion changes (transitions)
-        emotion_changes = 0
-        for i in range(1, len(emotions)):
-            if emotions[i] != emotions[i-1]:
-                emotion_changes += 1
+        # Emotion changes (transitions), counted as messages arrive
+        emotion_changes = st.session_state.emotion_changes
         
         # Generate insights
         insights = []
         
-        total_emotions = len(emotions)
+        total_emotions = sum(emotion_counts.values())
         
         # Dominant emotion insight
         percentage = (dominant_count / total_emotions) * 100
         insights.append(f"Your dominant emotion this session has been '{dominant_emotion}' ({percentage:.1f}% of the time)")
         
         # Emotional variety insight
-        unique_emotions = len(set(emotions))
+        unique_emotions = len(emotion_counts)
         if unique_emotions > 3:
             insights.append(f"You've experienced a wide range of emotions ({unique_emotions} different types)")
         elif unique_emotions == 1:
@@ -268,8 +304,9 @@ class SessionManager:
             insights.append("You've maintained relatively stable emotions during our conversation")
         
         # Recent emotion trend
-        if len(emotions) >= 3:
-            recent_emotions = emotions[-3:]
+        if total_emotions >= 3:
+            history = st.session_state.emotions_history
+            recent_emotions = [history[i]['emotion'] for i in range(-3, 0)]
             if len(set(recent_emotions)) == 1:
                 insights.append(f"Your recent messages consistently show '{recent_emotions[0]}' emotions")
         
@@ -287,12 +324,10 @@ class SessionManager:
             return {}
         
         # Group emotions by time periods
-        emotion_timeline = []
-        for entry in st.session_state.emotions_history:
-            emotion_timeline.append({
-                'emotion': entry['emotion'],
-                'minutes_since_start': (entry['timestamp'] - st.session_state.session_start_time).total_seconds() / 60
-            })
+        emotion_timeline = [{
+            'emotion': entry['emotion'],
+            'minutes_since_start': entry['minutes_since_start']
+        } for entry in st.session_state.emotion_timeline_cache]
         
         return {
             'timeline': emotion_timeline,
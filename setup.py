@@ -5,15 +5,16 @@ Automated setup for the AI therapy chatbot application
 """
 
 import os
+import shutil
 import subprocess
 import sys
 from pathlib import Path
 
-def run_command(command, description):
-    """Run a command and handle errors"""
+def run_command(command, description, env=None):
+    """Run a command (argv list) and handle errors"""
     print(f"\n{description}...")
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
+        result = subprocess.run(command, check=True, capture_output=True, text=True, env=env)
         print(f"✓ {description} completed successfully")
         return True
     except subprocess.CalledProcessError as e:
@@ -33,7 +34,13 @@ def check_python_version():
 def install_requirements():
     """Install Python requirements"""
     if Path("requirements.txt").exists():
-        return run_command("pip install -r requirements.txt", "Installing Python dependencies")
+        env = dict(os.environ, PIP_DISABLE_PIP_VERSION_CHECK="1")
+        # uv resolves and downloads in parallel, installs wheels and skips .pyc compilation by default
+        if shutil.which("uv"):
+            command = ["uv", "pip", "install", "--python", sys.executable, "-r", "requirements.txt"]
+        else:
+            command = [sys.executable, "-m", "pip", "install", "-r", "requirements.txt", "--no-compile", "--prefer-binary"]
+        return run_command(command, "Installing Python dependencies", env=env)
     else:
         print("✗ requirements.txt not found")
         return False
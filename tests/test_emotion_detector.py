@@ -0,0 +1,22 @@
+import unittest
+
+from emotion_detector import EmotionDetector
+
+
+class GetDetailedAnalysisTest(unittest.TestCase):
+    def test_changing_vader_scores_does_not_touch_the_cache(self):
+        detector = EmotionDetector()
+        text = "I feel terrible and hopeless today"
+        
+        first = detector.get_detailed_analysis(text)
+        expected = dict(first['vader_scores'])
+        first['vader_scores']['compound'] = 1.0
+        first['vader_scores'].clear()
+        
+        second = detector.get_detailed_analysis(text)
+        self.assertEqual(second['vader_scores'], expected)
+        self.assertEqual(detector._vader_scores(text), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from therapeutic_ai import TherapeuticAI
+
+
+class ModelRouterTest(unittest.TestCase):
+    def setUp(self):
+        # Routing needs only the model names, not a configured Gemini client
+        self.ai = TherapeuticAI.__new__(TherapeuticAI)
+        self.ai.model_name = TherapeuticAI.MODEL_NAME
+        self.ai.crisis_model_name = TherapeuticAI.CRISIS_MODEL_NAME
+    
+    def test_crisis_markers_route_to_crisis_model(self):
+        for message in ("I want to die", "I keep thinking about suicide", "I feel suicidal",
+                        "I might harm myself", "I've been self-harming", "thoughts of selfharm",
+                        "I harmed myself last night", "I feel like I'm dying",
+                        "I want to kill myself", "I keep thinking about ending my life",
+                        "sometimes I want to end my life", "I want to be dead", "everyone would be better off dead"):
+            with self.subTest(message=message):
+                self.assertEqual(self.ai._model_router('sad', message), TherapeuticAI.CRISIS_MODEL_NAME)
+    
+    def test_similar_words_stay_on_default_model(self):
+        for message in ("I miss the harmony we had", "it was a harmless joke", "sugar is harmful",
+                        "I started a new diet", "the studio closed"):
+            with self.subTest(message=message):
+                self.assertEqual(self.ai._model_router('sad', message), TherapeuticAI.MODEL_NAME)
+    
+    def test_crisis_phrases_route_but_harmony_does_not(self):
+        for message in ("I want to kill myself", "I want to end my life", "I just want to be dead"):
+            with self.subTest(message=message):
+                self.assertEqual(self.ai._model_router('fear', message), TherapeuticAI.CRISIS_MODEL_NAME)
+        for message in ("harmony", "I'm just killing time", "my phone is dead", "the end of my lifelong plan"):
+            with self.subTest(message=message):
+                self.assertEqual(self.ai._model_router('fear', message), TherapeuticAI.MODEL_NAME)
+    
+    def test_other_emotions_stay_on_default_model(self):
+        self.assertEqual(self.ai._model_router('happy', "I could die laughing"), TherapeuticAI.MODEL_NAME)
+
+
+if __name__ == '__main__':
+    unittest.main()
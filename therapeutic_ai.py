@@ -1,66 +1,15 @@
 import os
+import re
 import json
+import threading
+from collections import OrderedDict
 import google.generativeai as genai
 from datetime import datetime
 from remedy_generator import RemedyGenerator
 
 class TherapeuticAI:
-    def __init__(self):
-        """Initialize the therapeutic AI with Gemini Pro Vision API"""
-        self.gemini_api_key = os.getenv("GEMINI_API_KEY", "")
-        if not self.gemini_api_key:
-            raise ValueError("Gemini API key is required. Please set GEMINI_API_KEY environment variable.")
-        
-        genai.configure(api_key=self.gemini_api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
-        self.remedy_generator = RemedyGenerator()
-        
-        # Therapeutic response templates based on emotions
-        self.emotion_prompts = {
-            'happy': "The user is expressing happiness. Help them savor this positive moment and suggest ways to maintain or build on this joy. Offer gratitude practices or ways to share positivity.",
-            'sad': "The user is experiencing sadness. Provide immediate comfort techniques like breathing exercises, suggest gentle activities for mood lifting, and offer specific coping strategies for dealing with sadness.",
-            'angry': "The user is expressing anger. Offer immediate anger management techniques like deep breathing or physical release exercises. Suggest constructive ways to process and channel this energy.",
-            'anxious': "The user is showing signs of anxiety. Provide specific anxiety-reduction techniques like the 5-4-3-2-1 grounding method, breathing exercises, or progressive muscle relaxation. Offer practical steps to manage their worries.",
-            'fear': "The user is expressing fear. Offer grounding techniques to help them feel safe, suggest ways to break down their fears into manageable parts, and provide courage-building exercises.",
-            'surprise': "The user seems surprised or taken aback. Help them process this new information with mindfulness techniques and suggest ways to adapt to unexpected changes.",
-            'disgust': "The user is expressing disgust or revulsion. Help them understand these feelings and suggest healthy ways to distance themselves from what's bothering them, including boundary-setting techniques.",
-            'neutral': "The user's emotional state appears neutral. Use this as an opportunity to suggest proactive wellness practices, mindfulness exercises, or emotional awareness techniques."
-        }
-    
-    def generate_response(self, user_message, detected_emotion, conversation_history=None):
-        """
-        Generate a therapeutic response based on user input and detected emotion
-        """
-        try:
-            # Build the conversation context
-            prompt = self._build_conversation_context(user_message, detected_emotion, conversation_history)
-            
-            # Generate response using Gemini
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=300,
-                    temperature=0.7,
-                )
-            )
-            
-            ai_response = response.text.strip()
-            
-            # Enhance response with specific remedies
-            enhanced_response = self._enhance_with_remedies(ai_response, detected_emotion, user_message)
-            
-            # Ensure the response is appropriate and therapeutic
-            return self._validate_and_enhance_response(enhanced_response, detected_emotion)
-            
-        except Exception as e:
-            # Fallback response in case of API failure
-            return self._get_fallback_response(detected_emotion, str(e))
-    
-    def _build_conversation_context(self, user_message, detected_emotion, conversation_history):
-        """Build the conversation context for the AI"""
-        
-        # System prompt for therapeutic behavior
-        system_prompt = """You are a compassionate and empathetic AI therapy assistant. Your role is to:
+    # System prompt for therapeutic behavior
+    SYSTEM_PROMPT = """You are a compassionate and empathetic AI therapy assistant. Your role is to:
 
 1. Provide emotional support and active listening
 2. Offer practical, actionable coping strategies and remedies
@@ -85,27 +34,56 @@ Response structure:
 4. End with encouragement and next steps
 
 Remember: Focus on giving helpful, actionable advice while maintaining professional boundaries."""
-
-        # Build conversation context
-        context = system_prompt + "\n\n"
-        
-        # Add conversation history if available (last 3 exchanges to maintain context)
-        if conversation_history:
-            context += "Recent conversation:\n"
-            recent_history = conversation_history[-6:]  # Last 3 user-assistant pairs
-            for msg in recent_history:
-                role = "User" if msg['role'] == 'user' else "Assistant"
-                context += f"{role}: {msg['content']}\n"
-            context += "\n"
-        
-        # Add emotion context
-        emotion_context = self.emotion_prompts.get(detected_emotion, self.emotion_prompts['neutral'])
-        
-        # Current user message with emotion context
-        context += f"""Emotion detected: {detected_emotion}
-Context: {emotion_context}
-
-User message: "{user_message}"
+    
+    # Gemini model for replies and coping strategies; pinned to a stable version
+    MODEL_NAME = 'gemini-1.5-flash-002'
+    
+    # Larger model reserved for messages that may signal a crisis
+    CRISIS_MODEL_NAME = 'gemini-1.5-pro'
+    
+    # A message goes to the crisis model when it has one of these emotions and matches CRISIS_MARKERS_RE
+    CRISIS_EMOTIONS = frozenset({'sad', 'fear'})
+    CRISIS_MARKERS_RE = re.compile('|'.join([
+        r"\bsuicid",
+        r"\bharm(?:s|ed|ing)?\b",
+        r"\bself[- ]?harm",
+        r"\bdie\b",
+        r"\bdying\b",
+        r"\bkill(?:ing)? myself\b",
+        r"\bend(?:ing)? my life\b",
+        r"\b(?:want|wish) to be dead\b",
+        r"\bbetter off dead\b"
+    ]), re.IGNORECASE)
+    
+    # Most Gemini requests in flight at once across all sessions, to stay under rate limits
+    MAX_CONCURRENT_REQUESTS = 8
+    
+    # Estimated tokens of conversation history replayed in each prompt
+    HISTORY_TOKEN_BUDGET = 1500
+    
+    # Number of model replies kept per process, keyed by everything that goes into the prompt
+    RESPONSE_CACHE_SIZE = 512
+    
+    # Therapeutic response templates based on emotions
+    EMOTION_PROMPTS = {
+        'happy': "The user is expressing happiness. Help them savor this positive moment and suggest ways to maintain or build on this joy. Offer gratitude practices or ways to share positivity.",
+        'sad': "The user is experiencing sadness. Provide immediate comfort techniques like breathing exercises, suggest gentle activities for mood lifting, and offer specific coping strategies for dealing with sadness.",
+        'angry': "The user is expressing anger. Offer immediate anger management techniques like deep breathing or physical release exercises. Suggest constructive ways to process and channel this energy.",
+        'anxious': "The user is showing signs of anxiety. Provide specific anxiety-reduction techniques like the 5-4-3-2-1 grounding method, breathing exercises, or progressive muscle relaxation. Offer practical steps to manage their worries.",
+        'fear': "The user is expressing fear. Offer grounding techniques to help them feel safe, suggest ways to break down their fears into manageable parts, and provide courage-building exercises.",
+        'surprise': "The user seems surprised or taken aback. Help them process this new information with mindfulness techniques and suggest ways to adapt to unexpected changes.",
+        'disgust': "The user is expressing disgust or revulsion. Help them understand these feelings and suggest healthy ways to distance themselves from what's bothering them, including boundary-setting techniques.",
+        'neutral': "The user's emotional state appears neutral. Use this as an opportunity to suggest proactive wellness practices, mindfulness exercises, or emotional awareness techniques."
+    }
+    
+    # Emotion lines of the prompt, built once per known emotion
+    EMOTION_CONTEXT_BLOCKS = {
+        emotion: f"Emotion detected: {emotion}\nContext: {context}\n\n"
+        for emotion, context in EMOTION_PROMPTS.items()
+    }
+    
+    # Instructions closing every prompt, after the user message
+    PROMPT_INSTRUCTIONS = """
 
 Please provide a helpful response that includes:
 1. Acknowledgment of their emotional state
@@ -114,8 +92,266 @@ Please provide a helpful response that includes:
 4. Encouraging next steps or actions they can take
 
 Focus on giving actionable advice and specific techniques rather than just emotional validation."""
+    
+    # Opening sentence added when a reply does not acknowledge the emotion
+    EMOTION_VALIDATIONS = {
+        'happy': "It's wonderful to hear the positivity in your message.",
+        'sad': "I can sense that you're going through a difficult time.",
+        'angry': "I understand that you're feeling frustrated right now.",
+        'anxious': "It sounds like you're experiencing some worry or stress.",
+        'fear': "I hear that you're feeling concerned about something.",
+        'surprise': "It seems like something unexpected has happened.",
+        'disgust': "I can tell that something is really bothering you.",
+        'neutral': "Thank you for sharing your thoughts with me."
+    }
+    
+    # Replies used when Gemini is unavailable
+    FALLBACK_RESPONSES = {
+        'happy': "It's wonderful that you're feeling positive! Here's a simple technique to amplify this joy: Take a moment to write down three specific things that contributed to this happiness. This gratitude practice can help you recreate these positive experiences. Try sharing your joy with someone close to you - positive emotions grow when shared.",
+        
+        'sad': "I understand you're going through a difficult time. Here's an immediate technique that can help: Try the '4-7-8' breathing exercise - breathe in for 4 counts, hold for 7, exhale for 8. Repeat 3 times. Also, engage in gentle movement like a short walk, listen to comforting music, or do something kind for yourself today.",
+        
+        'angry': "I recognize your frustration. Here's an immediate anger management technique: Count slowly to 10 while taking deep breaths, or try progressive muscle relaxation - tense and release each muscle group. Physical exercise like walking or stretching can also help release this energy constructively. Consider writing your feelings down to process them.",
+        
+        'anxious': "I understand you're feeling anxious. Try this grounding technique right now: Look around and name 5 things you can see, 4 you can touch, 3 you can hear, 2 you can smell, and 1 you can taste. Follow this with slow, deep breathing. For ongoing anxiety, try scheduling 'worry time' - 15 minutes daily to address concerns, then redirect your focus.",
+        
+        'fear': "I hear your concerns. Here's a technique to help: Practice the 'STOP' method - Stop what you're doing, Take a breath, Observe your thoughts and feelings, then Proceed with intention. Break down your fear into smaller, manageable parts. What's one small step you could take today to address this concern?",
+        
+        'surprise': "Unexpected events can be unsettling. Try this mindfulness technique: Place both feet on the ground, take three deep breaths, and remind yourself that adaptation is a strength. Journal about this experience to process it. Ask yourself: 'What can I learn from this?' and 'How can I adapt moving forward?'",
+        
+        'disgust': "Strong negative feelings need healthy outlets. Try this: First, remove yourself from the source if possible. Practice deep breathing, then engage in a cleansing activity like taking a shower, cleaning your space, or doing something that makes you feel refreshed. Set clear boundaries about what you will and won't accept.",
+        
+        'neutral': "This is a great time for proactive wellness. Try this mindfulness exercise: Set a timer for 5 minutes and focus on your breathing. Notice thoughts without judgment. Consider starting a daily gratitude practice or setting one small, positive intention for today. What's one thing you'd like to accomplish or experience today?"
+    }
+    
+    # Coping strategies used when Gemini is unavailable
+    FALLBACK_COPING_STRATEGIES = {
+        'anxious': "1. Try deep breathing: Inhale for 4, hold for 4, exhale for 6\n2. Ground yourself using the 5-4-3-2-1 technique\n3. Take a short walk or do light stretching\n4. Write down your worries to externalize them",
+        'sad': "1. Allow yourself to feel the emotion without judgment\n2. Reach out to a trusted friend or family member\n3. Engage in a small self-care activity\n4. Try gentle movement or listen to comforting music",
+        'angry': "1. Take slow, deep breaths before responding\n2. Count to 10 or take a brief timeout\n3. Express your feelings through journaling\n4. Try progressive muscle relaxation",
+        'happy': "1. Savor this positive moment mindfully\n2. Share your joy with someone you care about\n3. Write down what you're grateful for\n4. Use this energy for a creative activity"
+    }
+    
+    # Words showing that a reply already acknowledges the user's feelings (matched as substrings)
+    VALIDATION_WORDS = ('understand', 'hear', 'feel', 'sounds', 'seems')
+    VALIDATION_WORDS_RE = re.compile('|'.join(VALIDATION_WORDS), re.IGNORECASE)
+    
+    # Claims of being a real therapist, replaced in replies (matched case-insensitively in one pass)
+    PROBLEMATIC_PHRASES_RE = re.compile('|'.join(map(re.escape, [
+        "as your therapist",
+        "i am a therapist",
+        "i'm a licensed",
+        "i can diagnose",
+        "my professional opinion"
+    ])), re.IGNORECASE)
+    
+    def __init__(self):
+        """Initialize the therapeutic AI with the Gemini API"""
+        self.gemini_api_key = os.getenv("GEMINI_API_KEY", "")
+        if not self.gemini_api_key:
+            raise ValueError("Gemini API key is required. Please set GEMINI_API_KEY environment variable.")
+        
+        genai.configure(api_key=self.gemini_api_key)
+        
+        # Model names can be overridden per deployment without code changes
+        self.model_name = os.getenv("GEMINI_MODEL", self.MODEL_NAME)
+        self.crisis_model_name = os.getenv("GEMINI_CRISIS_MODEL", self.CRISIS_MODEL_NAME)
+        self.model = genai.GenerativeModel(self.model_name)
+        self.crisis_model = genai.GenerativeModel(self.crisis_model_name)
+        self.remedy_generator = RemedyGenerator()
+        
+        # Streamlit runs each session's script on its own thread; this caps how many call Gemini together
+        self._request_slots = threading.BoundedSemaphore(self.MAX_CONCURRENT_REQUESTS)
+        
+        # Raw model replies; remedies and validation are still applied per call
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+    
+    def generate_response(self, user_message, detected_emotion, conversation_history=None):
+        """
+        Generate a therapeutic response based on user input and detected emotion
+        """
+        if self._model_router(detected_emotion, user_message) != self.model_name:
+            return self.generate_crisis_response(user_message, detected_emotion, conversation_history)
+        
+        try:
+            cache_key = self._response_cache_key(user_message, detected_emotion, conversation_history)
+            ai_response = self._response_cache_get(cache_key)
+            if ai_response is None:
+                # Build the conversation context
+                prompt = self._build_conversation_context(user_message, detected_emotion, conversation_history)
+                
+                # Generate response using Gemini
+                with self._request_slots:
+                    response = self.model.generate_content(
+                        prompt,
+                        generation_config=genai.types.GenerationConfig(
+                            max_output_tokens=300,
+                            temperature=0.7,
+                        )
+                    )
+                
+                ai_response = response.text.strip()
+                self._response_cache_put(cache_key, ai_response)
+            
+            # Enhance response with specific remedies
+            enhanced_response = self._enhance_with_remedies(ai_response, detected_emotion, user_message)
+            
+            # Ensure the response is appropriate and therapeutic
+            return self._validate_and_enhance_response(enhanced_response, detected_emotion)
+            
+        except Exception as e:
+            # Fallback response in case of API failure
+            return self._get_fallback_response(detected_emotion, str(e))
+    
+    def generate_response_stream(self, user_message, detected_emotion, conversation_history=None):
+        """
+        Generate a therapeutic response as a stream of text chunks.
+        Model output is yielded as it arrives, followed by the remedy suggestions;
+        pass the joined text to finalize_response before storing it.
+        """
+        if self._model_router(detected_emotion, user_message) != self.model_name:
+            # Sent in one piece; finalize_response still validates it
+            yield self._crisis_reply(user_message, detected_emotion, conversation_history)
+            return
+        
+        cache_key = self._response_cache_key(user_message, detected_emotion, conversation_history)
+        ai_response = self._response_cache_get(cache_key)
+        if ai_response is not None:
+            yield ai_response
+            enhanced_response = self._enhance_with_remedies(ai_response, detected_emotion, user_message)
+            yield enhanced_response[len(ai_response):]
+            return
+        
+        ai_response = ""
+        try:
+            prompt = self._build_conversation_context(user_message, detected_emotion, conversation_history)
+            
+            # The slot is held until the stream is fully read
+            with self._request_slots:
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        max_output_tokens=300,
+                        temperature=0.7,
+                    ),
+                    stream=True
+                )
+                
+                for chunk in response:
+                    ai_response += chunk.text
+                    yield chunk.text
+            
+        except Exception as e:
+            # Nothing useful was streamed, so fall back entirely
+            if not ai_response.strip():
+                yield self._get_fallback_response(detected_emotion, str(e))
+                return
+        else:
+            # Only complete replies are reused
+            self._response_cache_put(cache_key, ai_response.strip())
+        
+        # Append remedies once the model output is complete
+        enhanced_response = self._enhance_with_remedies(ai_response.strip(), detected_emotion, user_message)
+        yield enhanced_response[len(ai_response.strip()):]
+    
+    def generate_crisis_response(self, user_message, detected_emotion, conversation_history=None):
+        """
+        Generate a response with the crisis model for messages that may signal self-harm.
+        Replies are never cached and always carry the full system prompt.
+        """
+        crisis_response = self._crisis_reply(user_message, detected_emotion, conversation_history)
+        return self._validate_and_enhance_response(crisis_response, detected_emotion)
+    
+    def _crisis_reply(self, user_message, detected_emotion, conversation_history):
+        """Crisis model reply with remedies added, before validation"""
+        try:
+            prompt = self._build_conversation_context(user_message, detected_emotion, conversation_history)
+            
+            with self._request_slots:
+                response = self.crisis_model.generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        max_output_tokens=300,
+                        temperature=0.7,
+                    )
+                )
+            
+            return self._enhance_with_remedies(response.text.strip(), detected_emotion, user_message)
+            
+        except Exception as e:
+            return self._get_fallback_response(detected_emotion, str(e))
+    
+    def finalize_response(self, response, detected_emotion):
+        """Validate a streamed response before it is stored"""
+        return self._validate_and_enhance_response(response.strip(), detected_emotion)
+    
+    def _history_window(self, conversation_history):
+        """Longest run of most recent messages whose estimated size fits HISTORY_TOKEN_BUDGET"""
+        history = conversation_history or []
+        budget = self.HISTORY_TOKEN_BUDGET
+        start = len(history)
+        while start > 0:
+            # Roughly four characters per token; exact counts would need a Gemini round trip
+            budget -= len(history[start - 1]['content']) // 4 + 1
+            if budget < 0:
+                break
+            start -= 1
+        return history[start:]
+    
+    def _response_cache_key(self, user_message, detected_emotion, conversation_history):
+        """Key a reply by the emotion, the normalized message and the history the prompt includes"""
+        history = tuple((msg['role'], msg['content']) for msg in self._history_window(conversation_history))
+        return detected_emotion, ' '.join(user_message.lower().split()), history
+    
+    def _response_cache_get(self, key):
+        """Look up a cached model reply and mark it recently used"""
+        with self._response_cache_lock:
+            value = self._response_cache.get(key)
+            if value is not None:
+                self._response_cache.move_to_end(key)
+            return value
+    
+    def _response_cache_put(self, key, value):
+        """Store a model reply, evicting the least recently used beyond the limit"""
+        if not value:
+            return
+        
+        with self._response_cache_lock:
+            self._response_cache[key] = value
+            self._response_cache.move_to_end(key)
+            if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
+    def _model_router(self, emotion, message):
+        """Name of the model that should answer this message"""
+        if emotion in self.CRISIS_EMOTIONS and self.CRISIS_MARKERS_RE.search(message):
+            return self.crisis_model_name
+        return self.model_name
+    
+    def _build_conversation_context(self, user_message, detected_emotion, conversation_history):
+        """Build the conversation context for the AI"""
 
-        return context
+        # Build conversation context
+        parts = [self.SYSTEM_PROMPT, "\n\n"]
+        
+        # Add the most recent conversation history that fits the token budget
+        recent_history = self._history_window(conversation_history)
+        if recent_history:
+            parts.append("Recent conversation:\n")
+            parts.extend(
+                f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+                for msg in recent_history
+            )
+            parts.append("\n")
+        
+        # Current user message with emotion context
+        emotion_block = self.EMOTION_CONTEXT_BLOCKS.get(detected_emotion)
+        if emotion_block is None:
+            emotion_block = f"Emotion detected: {detected_emotion}\nContext: {self.EMOTION_PROMPTS['neutral']}\n\n"
+        parts.extend((emotion_block, f'User message: "{user_message}"', self.PROMPT_INSTRUCTIONS))
+        
+        return "".join(parts)
     
     def _validate_and_enhance_response(self, response, emotion):
         """Validate and enhance the AI response"""
@@ -124,21 +360,10 @@ Focus on giving actionable advice and specific techniques rather than just emoti
             return self._get_fallback_response(emotion, "Response too short")
         
         # Ensure the response doesn't claim to be a real therapist
-        problematic_phrases = [
-            "as your therapist",
-            "i am a therapist",
-            "i'm a licensed",
-            "i can diagnose",
-            "my professional opinion"
-        ]
-        
-        response_lower = response.lower()
-        for phrase in problematic_phrases:
-            if phrase in response_lower:
-                response = response.replace(phrase, "as an AI assistant")
+        response = self.PROBLEMATIC_PHRASES_RE.sub("as an AI assistant", response)
         
         # Add emotional validation if missing
-        if not any(word in response_lower for word in ['understand', 'hear', 'feel', 'sounds', 'seems']):
+        if not self.VALIDATION_WORDS_RE.search(response):
             emotion_validation = self._get_emotion_validation(emotion)
             response = f"{emotion_validation} {response}"
         
@@ -146,17 +371,7 @@ Focus on giving actionable advice and specific techniques rather than just emoti
     
     def _get_emotion_validation(self, emotion):
         """Get appropriate validation based on emotion"""
-        validations = {
-            'happy': "It's wonderful to hear the positivity in your message.",
-            'sad': "I can sense that you're going through a difficult time.",
-            'angry': "I understand that you're feeling frustrated right now.",
-            'anxious': "It sounds like you're experiencing some worry or stress.",
-            'fear': "I hear that you're feeling concerned about something.",
-            'surprise': "It seems like something unexpected has happened.",
-            'disgust': "I can tell that something is really bothering you.",
-            'neutral': "Thank you for sharing your thoughts with me."
-        }
-        return validations.get(emotion, validations['neutral'])
+        return self.EMOTION_VALIDATIONS.get(emotion, self.EMOTION_VALIDATIONS['neutral'])
     
     def _enhance_with_remedies(self, ai_response: str, emotion: str, user_message: str) -> str:
         """Enhance AI response with specific remedies"""
@@ -187,25 +402,7 @@ Focus on giving actionable advice and specific techniques rather than just emoti
     
     def _get_fallback_response(self, emotion, error_message=None):
         """Provide fallback responses when AI generation fails"""
-        fallback_responses = {
-            'happy': "It's wonderful that you're feeling positive! Here's a simple technique to amplify this joy: Take a moment to write down three specific things that contributed to this happiness. This gratitude practice can help you recreate these positive experiences. Try sharing your joy with someone close to you - positive emotions grow when shared.",
-            
-            'sad': "I understand you're going through a difficult time. Here's an immediate technique that can help: Try the '4-7-8' breathing exercise - breathe in for 4 counts, hold for 7, exhale for 8. Repeat 3 times. Also, engage in gentle movement like a short walk, listen to comforting music, or do something kind for yourself today.",
-            
-            'angry': "I recognize your frustration. Here's an immediate anger management technique: Count slowly to 10 while taking deep breaths, or try progressive muscle relaxation - tense and release each muscle group. Physical exercise like walking or stretching can also help release this energy constructively. Consider writing your feelings down to process them.",
-            
-            'anxious': "I understand you're feeling anxious. Try this grounding technique right now: Look around and name 5 things you can see, 4 you can touch, 3 you can hear, 2 you can smell, and 1 you can taste. Follow this with slow, deep breathing. For ongoing anxiety, try scheduling 'worry time' - 15 minutes daily to address concerns, then redirect your focus.",
-            
-            'fear': "I hear your concerns. Here's a technique to help: Practice the 'STOP' method - Stop what you're doing, Take a breath, Observe your thoughts and feelings, then Proceed with intention. Break down your fear into smaller, manageable parts. What's one small step you could take today to address this concern?",
-            
-            'surprise': "Unexpected events can be unsettling. Try this mindfulness technique: Place both feet on the ground, take three deep breaths, and remind yourself that adaptation is a strength. Journal about this experience to process it. Ask yourself: 'What can I learn from this?' and 'How can I adapt moving forward?'",
-            
-            'disgust': "Strong negative feelings need healthy outlets. Try this: First, remove yourself from the source if possible. Practice deep breathing, then engage in a cleansing activity like taking a shower, cleaning your space, or doing something that makes you feel refreshed. Set clear boundaries about what you will and won't accept.",
-            
-            'neutral': "This is a great time for proactive wellness. Try this mindfulness exercise: Set a timer for 5 minutes and focus on your breathing. Notice thoughts without judgment. Consider starting a daily gratitude practice or setting one small, positive intention for today. What's one thing you'd like to accomplish or experience today?"
-        }
-        
-        return fallback_responses.get(emotion, fallback_responses['neutral'])
+        return self.FALLBACK_RESPONSES.get(emotion, self.FALLBACK_RESPONSES['neutral'])
     
     def generate_coping_strategies(self, emotion, user_situation=None):
         """Generate specific coping strategies based on emotion and situation"""
@@ -219,22 +416,17 @@ Situation context: {user_situation if user_situation else 'General emotional sup
 
 Please provide strategies in a numbered list format."""
 
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=200,
-                    temperature=0.5,
+            with self._request_slots:
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        max_output_tokens=200,
+                        temperature=0.5,
+                    )
                 )
-            )
             
             return response.text.strip()
             
         except Exception:
             # Fallback coping strategies
-            fallback_strategies = {
-                'anxious': "1. Try deep breathing: Inhale for 4, hold for 4, exhale for 6\n2. Ground yourself using the 5-4-3-2-1 technique\n3. Take a short walk or do light stretching\n4. Write down your worries to externalize them",
-                'sad': "1. Allow yourself to feel the emotion without judgment\n2. Reach out to a trusted friend or family member\n3. Engage in a small self-care activity\n4. Try gentle movement or listen to comforting music",
-                'angry': "1. Take slow, deep breaths before responding\n2. Count to 10 or take a brief timeout\n3. Express your feelings through journaling\n4. Try progressive muscle relaxation",
-                'happy': "1. Savor this positive moment mindfully\n2. Share your joy with someone you care about\n3. Write down what you're grateful for\n4. Use this energy for a creative activity"
-            }
-            return fallback_strategies.get(emotion, "Focus on deep breathing and grounding techniques. Remember that all emotions are temporary and valid.")
+            return self.FALLBACK_COPING_STRATEGIES.get(emotion, "Focus on deep breathing and grounding techniques. Remember that all emotions are temporary and valid.")
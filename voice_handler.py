@@ -1,13 +1,179 @@
 import os
-import tempfile
+import re
+import atexit
+import threading
+import json
 import time
-from io import BytesIO
+import hashlib
+import shutil
+import tempfile
+import wave
+import zipfile
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 import speech_recognition as sr
-import pyttsx3
-from gtts import gTTS
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+@lru_cache(maxsize=1)
+def _tts_engine():
+    """Start the offline TTS engine once per process; pyttsx3 probes audio drivers on import and init"""
+    import pyttsx3
+    engine = pyttsx3.init()
+    engine.setProperty('rate', 150)  # Speed of speech
+    engine.setProperty('volume', 0.9)  # Volume level
+    return engine
+
+# Offline speech models, downloaded on first use
+MODEL_DIR = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'healthego', 'models')
+PIPER_VOICE_URL = "https://huggingface.co/rhasspy/piper-voices/resolve/main/en/en_US/lessac/medium/en_US-lessac-medium.onnx"
+VOSK_MODEL_URL = "https://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip"
+# Wait before retrying a model that failed to download or load (seconds)
+MODEL_RETRY_SECONDS = 300
+
+def _memoize_success(load):
+    """
+    Cache a loader's result once it is not None. A failed load (None) is retried,
+    but at most once per MODEL_RETRY_SECONDS so an offline machine is not re-downloading on every call.
+    """
+    lock = threading.Lock()
+    result = None
+    failed_at = None
+    
+    @wraps(load)
+    def wrapper():
+        nonlocal result, failed_at
+        with lock:
+            if result is None and (failed_at is None or time.monotonic() - failed_at >= MODEL_RETRY_SECONDS):
+                result = load()
+                failed_at = None if result is not None else time.monotonic()
+            return result
+    
+    # Current result without loading, for threads that must not wait on a download
+    wrapper.peek = lambda: result
+    return wrapper
+
+def _download(url, path):
+    """Download url to path, moving it into place only once complete"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, part_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.part', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        urllib.request.urlretrieve(url, part_path)
+        os.replace(part_path, path)
+    except BaseException:
+        os.remove(part_path)
+        raise
+
+@_memoize_success
+def _piper_voice():
+    """Load the Piper voice used when pyttsx3 is unavailable, or None if piper-tts or the model is unavailable"""
+    try:
+        from piper import PiperVoice
+        
+        # Fetch whichever of the voice's two files is missing, the config first
+        model_path = os.path.join(MODEL_DIR, os.path.basename(PIPER_VOICE_URL))
+        for url, path in ((PIPER_VOICE_URL + '.json', model_path + '.json'), (PIPER_VOICE_URL, model_path)):
+            if not os.path.exists(path):
+                _download(url, path)
+        
+        return PiperVoice.load(model_path)
+    except Exception:
+        return None
+
+@_memoize_success
+def _vosk_model():
+    """Load the Vosk speech recognition model, or None if vosk or the model is unavailable"""
+    try:
+        from vosk import Model, SetLogLevel
+        SetLogLevel(-1)
+        
+        model_path = os.path.join(MODEL_DIR, os.path.splitext(os.path.basename(VOSK_MODEL_URL))[0])
+        if not os.path.isdir(model_path):
+            archive = model_path + '.zip'
+            _download(VOSK_MODEL_URL, archive)
+            
+            # Extract beside the final location and rename, so a partial extraction never looks installed
+            extract_dir = tempfile.mkdtemp(prefix='.extract-', dir=MODEL_DIR)
+            try:
+                with zipfile.ZipFile(archive) as zf:
+                    zf.extractall(extract_dir)
+                os.replace(os.path.join(extract_dir, os.path.basename(model_path)), model_path)
+            finally:
+                shutil.rmtree(extract_dir, ignore_errors=True)
+                os.remove(archive)
+        
+        return Model(model_path)
+    except Exception:
+        return None
+
+class SpeechPipeline:
+    """Synthesizes a streamed reply sentence by sentence while the text is still arriving"""
+    
+    # A sentence ends at . ! or ? followed by whitespace
+    SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+    
+    def __init__(self, voice_handler):
+        self.voice_handler = voice_handler
+        self.streamed_text = ""
+        self._pending = ""
+        self._segments = []  # futures resolving to one audio file per sentence
+    
+    def feed(self, chunks):
+        """Pass text chunks through unchanged, queueing each completed sentence for synthesis"""
+        for chunk in chunks:
+            yield chunk
+            self.streamed_text += chunk
+            *sentences, self._pending = self.SENTENCE_END_RE.split(self._pending + chunk)
+            for sentence in sentences:
+                self._submit(sentence)
+    
+    def finish(self, final_text):
+        """
+        Combine the sentence audio into one file for final_text and return its path.
+        Text added in front of the streamed reply is synthesized separately; any other
+        difference falls back to synthesizing final_text in full.
+        """
+        self._submit(self._pending)
+        self._pending = ""
+        
+        streamed = self.streamed_text.strip()
+        try:
+            segments = [future.result() for future in self._segments]
+        except Exception:
+            # text_to_speech reports the error if synthesizing the whole reply fails too
+            segments = None
+        if not streamed or not final_text.endswith(streamed) or segments is None:
+            return self.voice_handler.text_to_speech(final_text)
+        
+        prefix = final_text[:-len(streamed)].strip()
+        if prefix:
+            prefix_audio = self.voice_handler.text_to_speech(prefix)
+            if not prefix_audio:
+                return self.voice_handler.text_to_speech(final_text)
+            segments.insert(0, prefix_audio)
+        
+        try:
+            return self.voice_handler._submit_tts(self.voice_handler._join_audio_files, segments, final_text).result()
+        except Exception:
+            return self.voice_handler.text_to_speech(final_text)
+    
+    def _submit(self, sentence):
+        if sentence.strip():
+            self._segments.append(self.voice_handler._submit_tts(self.voice_handler._save_speech_to_file, sentence))
 
 class VoiceHandler:
+    # Synthesized audio is kept here by text, so repeated replies are synthesized once
+    TTS_CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'healthego', 'tts')
+    # Least recently used audio is deleted beyond this size
+    TTS_CACHE_MAX_BYTES = 100 * 1024 * 1024
+    # Name prefix of audio still being written into the cache
+    TTS_PARTIAL_PREFIX = '.part-'
+    # Partial audio older than this was left by an interrupted write (seconds); newer files may still be in progress
+    TTS_PARTIAL_MAX_AGE = 3600
+    
     def __init__(self):
         """Initialize voice handling components"""
         self.recognizer = sr.Recognizer()
@@ -22,24 +188,62 @@ class VoiceHandler:
             st.info("Voice input not available in this environment. Text-to-speech will still work.")
             self.microphone_available = False
         
+        self.tts_cache_dir = self.TTS_CACHE_DIR
+        try:
+            os.makedirs(self.tts_cache_dir, exist_ok=True)
+        except OSError:
+            self.tts_cache_dir = tempfile.mkdtemp(prefix='healthego-tts-')
+        
+        # All synthesis and playback runs on one worker, since the TTS engine is not thread-safe
+        self._tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts')
+        atexit.register(self._tts_executor.shutdown, wait=False, cancel_futures=True)
+        
+        # Trim what earlier runs left in the shared cache, without delaying startup
+        self._tts_executor.submit(self._cleanup_tts_cache)
+        
+        # Work queued on the shared worker by each session, so one session can cancel only its own
+        self._tts_futures = {}
+        self._tts_futures_lock = threading.Lock()
+        
         # Initialize text-to-speech engine
         try:
-            self.tts_engine = pyttsx3.init()
-            self.tts_engine.setProperty('rate', 150)  # Speed of speech
-            self.tts_engine.setProperty('volume', 0.9)  # Volume level
+            self.tts_engine = _tts_engine()
             self.use_pyttsx3 = True
         except Exception:
             self.use_pyttsx3 = False
             # Don't show warning on every initialization
         
-        # Adjust for ambient noise only if microphone is available
-        if self.microphone_available:
+        # The microphone is opened on first use and stays open; its stream is paused between listens
+        self._mic_source = None
+        self._mic_lock = threading.Lock()
+        
+        # Ambient noise calibration takes a second, so it waits for the first use of the microphone
+        self._calibrated = False
+    
+    @contextmanager
+    def _listening(self):
+        """Hold the microphone for one listen, opening and calibrating it on first use"""
+        with self._mic_lock:
+            if self._mic_source is None:
+                self._mic_source = self.microphone.__enter__()
+                atexit.register(self.close)
+            else:
+                self._mic_source.stream.pyaudio_stream.start_stream()
+            
             try:
-                with self.microphone as source:
-                    self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            except Exception as e:
-                st.warning(f"Could not adjust for ambient noise: {e}")
-                self.microphone_available = False
+                if not self._calibrated:
+                    self._calibrated = True
+                    self.recognizer.adjust_for_ambient_noise(self._mic_source, duration=1)
+                yield self._mic_source
+            finally:
+                self._mic_source.stream.pyaudio_stream.stop_stream()
+    
+    def close(self):
+        """Close the microphone stream if it is open"""
+        with self._mic_lock:
+            if self._mic_source is not None:
+                self._mic_source = None
+                self.microphone.__exit__(None, None, None)
     
     def speech_to_text(self, timeout=5, phrase_time_limit=10):
         """
@@ -51,22 +255,30 @@ class VoiceHandler:
             return None
             
         try:
-            with self.microphone as source:
+            # Fetch the offline model before the prompt, so the first download doesn't eat into listening
+            with st.spinner("Loading offline speech recognition..."):
+                model = _vosk_model()
+            
+            with self._listening() as source:
                 st.info("🎤 Listening... Please speak now!")
                 
-                # Listen for audio with timeout
-                audio = self.recognizer.listen(
-                    source, 
-                    timeout=timeout, 
-                    phrase_time_limit=phrase_time_limit
-                )
+                # Recognize offline while listening, showing partial transcripts as they arrive
+                if model is not None:
+                    text, audio = self._listen_with_vosk(source, model, timeout, phrase_time_limit)
+                    if text:
+                        st.success("✅ Speech recognized (offline)!")
+                        return text
+                else:
+                    # Listen for audio with timeout
+                    audio = self.recognizer.listen(
+                        source, 
+                        timeout=timeout, 
+                        phrase_time_limit=phrase_time_limit
+                    )
                 
                 st.info("🔄 Processing speech...")
                 
-                # Try multiple recognition services for better accuracy
-                text = None
-                
-                # Try Google Speech Recognition first (most accurate)
+                # Fall back to Google Speech Recognition on the recorded audio
                 try:
                     text = self.recognizer.recognize_google(audio)
                     st.success("✅ Speech recognized successfully!")
@@ -76,14 +288,6 @@ class VoiceHandler:
                 except sr.UnknownValueError:
                     pass
                 
-                # Fallback to offline recognition if available
-                try:
-                    text = self.recognizer.recognize_sphinx(audio)
-                    st.success("✅ Speech recognized (offline)!")
-                    return text
-                except (sr.RequestError, sr.UnknownValueError):
-                    pass
-                
                 # If all methods fail
                 st.error("❌ Could not understand the audio. Please try speaking clearly.")
                 return None
@@ -95,6 +299,42 @@ class VoiceHandler:
             st.error(f"❌ Speech recognition error: {str(e)}")
             return None
     
+    def _listen_with_vosk(self, source, model, timeout, phrase_time_limit):
+        """
+        Stream microphone audio into Vosk until a phrase is complete
+        Returns the transcript (possibly empty) and the recorded audio for fallback recognizers
+        """
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(model, source.SAMPLE_RATE)
+        partial_display = st.empty()
+        frames = []
+        started = time.monotonic()
+        speech_started = None
+        
+        while True:
+            data = source.stream.read(source.CHUNK)
+            frames.append(data)
+            now = time.monotonic()
+            
+            if recognizer.AcceptWaveform(data):
+                text = json.loads(recognizer.Result())['text']
+                if text:
+                    break
+            else:
+                partial = json.loads(recognizer.PartialResult())['partial']
+                if partial:
+                    speech_started = speech_started or now
+                    partial_display.caption(f"🎤 {partial}")
+            
+            if speech_started is None and now - started > timeout:
+                raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+            if speech_started is not None and now - speech_started > phrase_time_limit:
+                text = json.loads(recognizer.FinalResult())['text']
+                break
+        
+        partial_display.empty()
+        return text, sr.AudioData(b''.join(frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+    
     def text_to_speech(self, text, save_to_file=True):
         """
         Convert text to speech
@@ -105,7 +345,7 @@ class VoiceHandler:
         
         try:
             if save_to_file:
-                return self._save_speech_to_file(text)
+                return self._submit_tts(self._save_speech_to_file, text).result()
             else:
                 self._play_speech_direct(text)
                 return None
@@ -115,37 +355,131 @@ class VoiceHandler:
             return None
     
     def _save_speech_to_file(self, text):
-        """Save speech to a temporary audio file"""
+        """Save speech to an audio file in the TTS cache, synthesizing only on a cache miss"""
+        engine = self._tts_engine_name()
+        try:
+            return self._synthesize_to_cache(text, engine)
+        except Exception:
+            if engine != 'piper':
+                raise
+            # Piper loaded but failed on this text; gTTS may still manage it
+            return self._synthesize_to_cache(text, 'gtts')
+    
+    def _synthesize_to_cache(self, text, engine):
+        """Synthesize text with one engine into its TTS cache entry"""
+        temp_file = None
         try:
-            # Create a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
+            path = self._tts_cache_path(text, engine)
+            if os.path.exists(path):
+                os.utime(path)  # Mark as recently used
+                return path
+            
+            # Write beside the cache entry and move it into place, so no reader sees a partial file
+            temp_file = tempfile.NamedTemporaryFile(delete=False, prefix=self.TTS_PARTIAL_PREFIX, suffix=os.path.splitext(path)[1], dir=self.tts_cache_dir)
             temp_file.close()
             
-            if self.use_pyttsx3:
+            if engine == 'pyttsx3':
                 # Use pyttsx3 for offline TTS
                 self.tts_engine.save_to_file(text, temp_file.name)
                 self.tts_engine.runAndWait()
+            elif engine == 'piper':
+                # Use Piper for offline neural TTS
+                with wave.open(temp_file.name, 'wb') as wav_file:
+                    _piper_voice.peek().synthesize_wav(text, wav_file)
             else:
-                # Use gTTS for online TTS
+                # Use gTTS for online TTS (MP3 output) as a last resort
+                from gtts import gTTS
                 tts = gTTS(text=text, lang='en', slow=False)
-                
-                # Save to temporary MP3 file first
-                temp_mp3 = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-                temp_mp3.close()
-                tts.save(temp_mp3.name)
-                
-                # Convert MP3 to WAV if needed (for compatibility)
-                # For simplicity, we'll return the MP3 file
-                return temp_mp3.name
+                tts.save(temp_file.name)
             
-            return temp_file.name
+            os.replace(temp_file.name, path)
+            self._prune_tts_cache()
+            return path
             
-        except Exception as e:
-            st.error(f"Error saving speech to file: {str(e)}")
-            return None
+        except Exception:
+            # Runs on the TTS worker, which cannot show errors; callers report them from result()
+            if temp_file is not None and os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
+            raise
+    
+    def _tts_engine_name(self):
+        """Engine used for new audio; Piper only once its voice has been loaded off the worker"""
+        return 'pyttsx3' if self.use_pyttsx3 else 'piper' if _piper_voice.peek() else 'gtts'
+    
+    def _tts_cache_path(self, text, engine=None):
+        """Cache file for text as synthesized by engine (the current engine by default)"""
+        engine = engine or self._tts_engine_name()
+        suffix = '.mp3' if engine == 'gtts' else '.wav'
+        key = hashlib.sha1(f"{engine}:{text}".encode('utf-8')).hexdigest()
+        return os.path.join(self.tts_cache_dir, key + suffix)
+    
+    def _prune_tts_cache(self):
+        """Delete the least recently used cached audio beyond TTS_CACHE_MAX_BYTES"""
+        entries = []
+        with os.scandir(self.tts_cache_dir) as it:
+            for entry in it:
+                # Partial files belong to writes in progress, possibly in another process
+                if entry.name.startswith(self.TTS_PARTIAL_PREFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.TTS_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    
+    def speech_pipeline(self):
+        """Start synthesizing a reply that is still being streamed; see SpeechPipeline"""
+        return SpeechPipeline(self)
+    
+    def _join_audio_files(self, paths, text):
+        """Concatenate audio files of one format into the TTS cache entry for text"""
+        suffix = os.path.splitext(paths[0])[1]
+        cache_path = self._tts_cache_path(text)
+        if any(not path.endswith(suffix) for path in paths) or not cache_path.endswith(suffix):
+            # Some sentences fell back to another engine
+            raise ValueError("audio segments differ in format")
+        
+        joined = tempfile.NamedTemporaryFile(delete=False, prefix=self.TTS_PARTIAL_PREFIX, suffix=suffix, dir=self.tts_cache_dir)
+        joined.close()
+        
+        try:
+            if suffix == '.mp3':
+                # MP3 is a sequence of independent frames, so parts can be appended byte for byte
+                with open(joined.name, 'wb') as out:
+                    for path in paths:
+                        with open(path, 'rb') as part:
+                            out.write(part.read())
+            else:
+                with wave.open(joined.name, 'wb') as out:
+                    for i, path in enumerate(paths):
+                        with wave.open(path, 'rb') as part:
+                            if i == 0:
+                                out.setparams(part.getparams())
+                            out.writeframes(part.readframes(part.getnframes()))
+        except Exception:
+            os.remove(joined.name)
+            raise
+        
+        os.replace(joined.name, cache_path)
+        self._prune_tts_cache()
+        return cache_path
     
     def _play_speech_direct(self, text):
-        """Play speech directly without saving to file"""
+        """Queue speech for playback on the TTS worker and return immediately"""
+        self._submit_tts(self._speak, text)
+    
+    def _speak(self, text):
+        """Play speech directly without saving to file (runs on the TTS worker)"""
         try:
             if self.use_pyttsx3:
                 self.tts_engine.say(text)
@@ -158,8 +492,53 @@ class VoiceHandler:
                     # The file approach is more reliable
                     pass
                     
-        except Exception as e:
-            st.error(f"Error playing speech: {str(e)}")
+        except Exception:
+            # Off the script thread there is no page to report errors on
+            pass
+    
+    def _submit_tts(self, fn, *args):
+        """Queue fn on the TTS worker on behalf of the calling session"""
+        owner = self._tts_owner()
+        if not self.use_pyttsx3:
+            # Fetch the Piper voice here, so a download never holds up the shared worker
+            _piper_voice()
+        
+        with self._tts_futures_lock:
+            future = self._tts_executor.submit(fn, *args)
+            self._tts_futures.setdefault(owner, set()).add(future)
+        future.add_done_callback(lambda f: self._forget_tts_future(owner, f))
+        return future
+    
+    @staticmethod
+    def _tts_owner():
+        """Streamlit session of the caller, or its thread outside a script run"""
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else threading.get_ident()
+    
+    def _forget_tts_future(self, owner, future):
+        with self._tts_futures_lock:
+            futures = self._tts_futures.get(owner)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._tts_futures[owner]
+    
+    def flush(self):
+        """Wait until all queued speech has been synthesized or played"""
+        self._tts_executor.submit(lambda: None).result()
+    
+    def stop(self):
+        """Drop this session's queued speech and interrupt it if it is playing; other sessions are unaffected"""
+        owner = self._tts_owner()
+        with self._tts_futures_lock:
+            futures = list(self._tts_futures.get(owner, ()))
+        
+        playing = False
+        for future in futures:
+            if not future.cancel() and future.running():
+                playing = True
+        if playing and self.use_pyttsx3:
+            self.tts_engine.stop()
     
     def get_available_voices(self):
         """Get list of available TTS voices"""
@@ -218,7 +597,7 @@ class VoiceHandler:
             return False
             
         try:
-            with self.microphone as source:
+            with self._listening() as source:
                 st.info("Testing microphone... Say something!")
                 audio = self.recognizer.listen(source, timeout=3, phrase_time_limit=3)
                 text = self.recognizer.recognize_google(audio)
@@ -229,7 +608,18 @@ class VoiceHandler:
             return False
     
     def cleanup_temp_files(self):
-        """Clean up temporary audio files"""
-        # This method can be expanded to track and clean up temporary files
-        # For now, we rely on the OS to clean up /tmp files
-        pass
+        """Delete stale partial audio left by interrupted synthesis and trim the TTS cache to its limit"""
+        # Runs on the TTS worker so no file is removed while it is being written
+        self._submit_tts(self._cleanup_tts_cache).result()
+    
+    def _cleanup_tts_cache(self):
+        # The cache directory is shared between processes, so only long-abandoned partial files are removed
+        cutoff = time.time() - self.TTS_PARTIAL_MAX_AGE
+        with os.scandir(self.tts_cache_dir) as it:
+            for entry in it:
+                try:
+                    if entry.name.startswith(self.TTS_PARTIAL_PREFIX) and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+        self._prune_tts_cache()